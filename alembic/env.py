@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -21,6 +22,10 @@ if config.config_file_name is not None:
 from src import ResultData
 target_metadata = ResultData.Base.metadata
 
+# fsperf itself takes the db from FSPERF_DB, so migrate the same one
+if os.environ.get("FSPERF_DB"):
+    config.set_main_option("sqlalchemy.url", os.environ["FSPERF_DB"])
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -0,0 +1,28 @@
+"""run repetitions
+
+Revision ID: 0e6a3b7c4f19
+Revises: 6c1f4d9a2e75
+Create Date: 2026-10-18 15:41:27.093816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Float, Integer
+
+
+revision: str = '0e6a3b7c4f19'
+down_revision: Union[str, None] = '6c1f4d9a2e75'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('nr_runs', Integer, default=1))
+    op.add_column('runs', Column('ci_pct', Float))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('ci_pct')
+        batch_op.drop_column('nr_runs')
@@ -0,0 +1,41 @@
+"""fragmentation series
+
+Revision ID: 1f8b3d6e2a94
+Revises: 5a8e0f2b7c91
+Create Date: 2026-10-18 19:12:05.287431
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Float, ForeignKey, Integer, LargeBinary
+
+
+revision: str = '1f8b3d6e2a94'
+down_revision: Union[str, None] = '5a8e0f2b7c91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "fragmentation_series",
+        Column('id', Integer, primary_key=True),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="CASCADE"), nullable=False),
+        Column('interval_ms', Integer, default=0),
+        Column('nr_fields', Integer, default=0),
+        Column('samples', LargeBinary),
+    )
+    op.create_index('ix_fragmentation_series_run_id', 'fragmentation_series',
+                    ['run_id'])
+    op.add_column('fragmentation', Column('peak_frag_pct_p50', Float))
+    op.add_column('fragmentation', Column('peak_frag_pct_p95', Float))
+    op.add_column('fragmentation', Column('peak_frag_pct_max', Float))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('fragmentation') as batch_op:
+        batch_op.drop_column('peak_frag_pct_max')
+        batch_op.drop_column('peak_frag_pct_p95')
+        batch_op.drop_column('peak_frag_pct_p50')
+    op.drop_table('fragmentation_series')
@@ -0,0 +1,40 @@
+"""iostats series
+
+Revision ID: 3a7c1e9d2b40
+Revises: f2b6313d4618
+Create Date: 2026-10-18 09:12:41.220614
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Float, ForeignKey, Integer, LargeBinary
+
+
+revision: str = '3a7c1e9d2b40'
+down_revision: Union[str, None] = 'f2b6313d4618'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('io_stats', Column('dev_kbytes_per_sec_p50', Float, default=0.0))
+    op.add_column('io_stats', Column('dev_kbytes_per_sec_p99', Float, default=0.0))
+    op.add_column('io_stats', Column('dev_max_stall_ms', Integer, default=0))
+
+    op.create_table(
+        "io_stats_series",
+        Column('id', Integer, primary_key=True),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="CASCADE"), nullable=False),
+        Column('interval_ms', Integer, default=0),
+        Column('nr_fields', Integer, default=0),
+        Column('samples', LargeBinary),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('io_stats_series')
+    with op.batch_alter_table('io_stats') as batch_op:
+        batch_op.drop_column('dev_max_stall_ms')
+        batch_op.drop_column('dev_kbytes_per_sec_p99')
+        batch_op.drop_column('dev_kbytes_per_sec_p50')
@@ -0,0 +1,29 @@
+"""run changepoints done
+
+Revision ID: 3d9f6e1a7c52
+Revises: 7e2b9c40d5a8
+Create Date: 2026-10-18 22:31:08.245917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Boolean, Column
+
+
+revision: str = '3d9f6e1a7c52'
+down_revision: Union[str, None] = '7e2b9c40d5a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('changepoints_done', Boolean, default=False))
+    # Until now everything up to the newest run in any series had been seen
+    op.execute("UPDATE runs SET changepoints_done = (id <= "
+               "(SELECT COALESCE(MAX(last_run_id), 0) FROM changepoint_state))")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('changepoints_done')
@@ -0,0 +1,42 @@
+"""metric rollups
+
+Revision ID: 4b9e8f2d6a13
+Revises: e0b7d35c91af
+Create Date: 2026-10-18 12:08:33.460921
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Date, Float, Integer, String, UniqueConstraint
+
+
+revision: str = '4b9e8f2d6a13'
+down_revision: Union[str, None] = 'e0b7d35c91af'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # generate-results-page.py folds in the existing runs, see the
+    # runs.rolled_up flag
+    op.create_table(
+        "metric_rollups",
+        Column('id', Integer, primary_key=True),
+        Column('name', String),
+        Column('config', String),
+        Column('purpose', String),
+        Column('metric', String),
+        Column('day', Date),
+        Column('count', Integer, default=0),
+        Column('sum', Float, default=0.0),
+        Column('sumsq', Float, default=0.0),
+        Column('min', Float),
+        Column('max', Float),
+        UniqueConstraint('name', 'config', 'purpose', 'day', 'metric',
+                         name='ix_metric_rollups_key'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('metric_rollups')
@@ -0,0 +1,26 @@
+"""run aging
+
+Revision ID: 5a8e0f2b7c91
+Revises: d7a2c58e1f36
+Create Date: 2026-10-18 17:02:36.418592
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, String
+
+
+revision: str = '5a8e0f2b7c91'
+down_revision: Union[str, None] = 'd7a2c58e1f36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('aging', String, default=""))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('aging')
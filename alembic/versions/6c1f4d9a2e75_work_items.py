@@ -0,0 +1,45 @@
+"""work items
+
+Revision ID: 6c1f4d9a2e75
+Revises: b83c4f1e0d27
+Create Date: 2026-10-18 15:04:11.582307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+
+revision: str = '6c1f4d9a2e75'
+down_revision: Union[str, None] = 'b83c4f1e0d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "work_items",
+        Column('id', Integer, primary_key=True),
+        Column('batch', String),
+        Column('test', String),
+        Column('config', String),
+        Column('kernel', String),
+        Column('purpose', String),
+        Column('run_index', Integer),
+        Column('state', String, default="pending"),
+        Column('hostname', String),
+        Column('claimed', DateTime),
+        Column('finished', DateTime),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="SET NULL")),
+        Column('error', String),
+    )
+    op.create_index('ix_work_items_batch', 'work_items', ['batch'])
+    op.create_index('ix_work_items_state_kernel', 'work_items',
+                    ['state', 'kernel'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_work_items_state_kernel', table_name='work_items')
+    op.drop_index('ix_work_items_batch', table_name='work_items')
+    op.drop_table('work_items')
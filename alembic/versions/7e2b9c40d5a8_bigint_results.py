@@ -0,0 +1,45 @@
+"""bigint results
+
+Revision ID: 7e2b9c40d5a8
+Revises: a4d1c7e93b05
+Create Date: 2026-10-18 22:05:51.613720
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import BigInteger, Integer
+
+
+revision: str = '7e2b9c40d5a8'
+down_revision: Union[str, None] = 'a4d1c7e93b05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Byte counts and nanosecond latencies easily go past 2^31, which sqlite
+# doesn't care about but Postgres' 4 byte integer does.
+COLUMNS = {
+    'fio_results': ['read_io_bytes'] +
+                   [f"{d}_{c}" for d in ('read', 'write')
+                    for c in ('lat_ns_min', 'lat_ns_max', 'lat_ns_mean',
+                              'clat_ns_p50', 'clat_ns_p99', 'clat_ns_mean',
+                              'io_kbytes', 'bw_bytes')],
+    'io_stats': ['dev_read_kbytes', 'dev_write_kbytes'],
+    'mount_timings': ['end_state_umount_ns', 'end_state_mount_ns'],
+}
+
+
+def upgrade() -> None:
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=Integer,
+                                      type_=BigInteger)
+
+
+def downgrade() -> None:
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=BigInteger,
+                                      type_=Integer)
@@ -0,0 +1,45 @@
+"""fio time series
+
+Revision ID: 8d41f6a0c7e3
+Revises: 3a7c1e9d2b40
+Create Date: 2026-10-18 10:03:17.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Float, ForeignKey, Integer, LargeBinary, String
+
+
+revision: str = '8d41f6a0c7e3'
+down_revision: Union[str, None] = '3a7c1e9d2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "fio_time_series",
+        Column('id', Integer, primary_key=True),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="CASCADE"), nullable=False),
+        Column('metric', String),
+        Column('interval_ms', Integer, default=0),
+        Column('samples', LargeBinary),
+    )
+
+    op.create_table(
+        "fio_log_stats",
+        Column('id', Integer, primary_key=True),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="CASCADE"), nullable=False),
+        Column('read_bw_steady_bytes', Float, default=0.0),
+        Column('read_bw_slope_pct', Float, default=0.0),
+        Column('write_bw_steady_bytes', Float, default=0.0),
+        Column('write_bw_slope_pct', Float, default=0.0),
+        Column('trim_bw_steady_bytes', Float, default=0.0),
+        Column('trim_bw_slope_pct', Float, default=0.0),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('fio_log_stats')
+    op.drop_table('fio_time_series')
@@ -0,0 +1,40 @@
+"""long format metrics
+
+Revision ID: 9f3d0a6b58c2
+Revises: 4b9e8f2d6a13
+Create Date: 2026-10-18 13:15:02.617384
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Float, ForeignKey, Integer, String
+
+
+revision: str = '9f3d0a6b58c2'
+down_revision: Union[str, None] = '4b9e8f2d6a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('fio_results', Column('jobname', String))
+
+    # metrics.backfill() fills this in for existing runs
+    op.create_table(
+        "metrics",
+        Column('id', Integer, primary_key=True),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="CASCADE"), nullable=False),
+        Column('source', String),
+        Column('job', String),
+        Column('metric', String),
+        Column('value', Float),
+    )
+    op.create_index('ix_metrics_run_id', 'metrics', ['run_id'])
+    op.create_index('ix_metrics_metric_run_id', 'metrics', ['metric', 'run_id'])
+
+
+def downgrade() -> None:
+    op.drop_table('metrics')
+    with op.batch_alter_table('fio_results') as batch_op:
+        batch_op.drop_column('jobname')
@@ -0,0 +1,29 @@
+"""run rolled up
+
+Revision ID: a4d1c7e93b05
+Revises: 1f8b3d6e2a94
+Create Date: 2026-10-18 21:40:17.902364
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Boolean, Column
+
+
+revision: str = 'a4d1c7e93b05'
+down_revision: Union[str, None] = '1f8b3d6e2a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('rolled_up', Boolean, default=False))
+    # There's no telling which runs the existing rollups already hold, so
+    # start over and let rollup.backfill() fold every run back in.
+    op.execute("DELETE FROM metric_rollups")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('rolled_up')
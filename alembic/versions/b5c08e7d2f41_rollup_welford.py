@@ -0,0 +1,39 @@
+"""rollup welford
+
+Revision ID: b5c08e7d2f41
+Revises: 3d9f6e1a7c52
+Create Date: 2026-10-19 10:14:42.530178
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, Float
+
+
+revision: str = 'b5c08e7d2f41'
+down_revision: Union[str, None] = '3d9f6e1a7c52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The old sums can't be turned into an accurate m2, so have
+    # rollup.backfill() fold every run in again
+    op.execute("DELETE FROM metric_rollups")
+    op.execute("UPDATE runs SET rolled_up = false")
+    with op.batch_alter_table('metric_rollups') as batch_op:
+        batch_op.drop_column('sum')
+        batch_op.drop_column('sumsq')
+        batch_op.add_column(Column('mean', Float, default=0.0))
+        batch_op.add_column(Column('m2', Float, default=0.0))
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM metric_rollups")
+    op.execute("UPDATE runs SET rolled_up = false")
+    with op.batch_alter_table('metric_rollups') as batch_op:
+        batch_op.drop_column('mean')
+        batch_op.drop_column('m2')
+        batch_op.add_column(Column('sum', Float, default=0.0))
+        batch_op.add_column(Column('sumsq', Float, default=0.0))
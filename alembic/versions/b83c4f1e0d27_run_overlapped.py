@@ -0,0 +1,26 @@
+"""run overlapped
+
+Revision ID: b83c4f1e0d27
+Revises: 9f3d0a6b58c2
+Create Date: 2026-10-18 14:22:49.310552
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, String
+
+
+revision: str = 'b83c4f1e0d27'
+down_revision: Union[str, None] = '9f3d0a6b58c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('overlapped', String, default=""))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('overlapped')
@@ -0,0 +1,30 @@
+"""fio percentiles
+
+Revision ID: c5e2a9174b18
+Revises: 8d41f6a0c7e3
+Create Date: 2026-10-18 10:41:55.093177
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, LargeBinary
+
+
+revision: str = 'c5e2a9174b18'
+down_revision: Union[str, None] = '8d41f6a0c7e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('fio_results', Column('percentiles', LargeBinary))
+    op.add_column('fio_results', Column('read_clat_hist', LargeBinary))
+    op.add_column('fio_results', Column('write_clat_hist', LargeBinary))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('fio_results') as batch_op:
+        batch_op.drop_column('write_clat_hist')
+        batch_op.drop_column('read_clat_hist')
+        batch_op.drop_column('percentiles')
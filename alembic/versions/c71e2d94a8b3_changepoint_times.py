@@ -0,0 +1,27 @@
+"""changepoint times
+
+Revision ID: c71e2d94a8b3
+Revises: e8a4f17c3d60
+Create Date: 2026-10-19 11:31:47.219506
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Column, LargeBinary
+
+
+revision: str = 'c71e2d94a8b3'
+down_revision: Union[str, None] = 'e8a4f17c3d60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # changepoints.py looks up the times for existing segments as it goes
+    op.add_column('changepoint_state', Column('times', LargeBinary))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('changepoint_state') as batch_op:
+        batch_op.drop_column('times')
@@ -0,0 +1,59 @@
+"""changepoints
+
+Revision ID: d7a2c58e1f36
+Revises: 0e6a3b7c4f19
+Create Date: 2026-10-18 16:20:52.774103
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import (Boolean, Column, Float, ForeignKey, Integer,
+                        LargeBinary, String, UniqueConstraint)
+
+
+revision: str = 'd7a2c58e1f36'
+down_revision: Union[str, None] = '0e6a3b7c4f19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # generate-results-page.py fills these in from the existing runs
+    op.create_table(
+        "changepoint_state",
+        Column('id', Integer, primary_key=True),
+        Column('name', String),
+        Column('config', String),
+        Column('source', String),
+        Column('job', String),
+        Column('metric', String),
+        Column('last_run_id', Integer, default=0),
+        Column('run_ids', LargeBinary),
+        Column('values', LargeBinary),
+        UniqueConstraint('name', 'config', 'source', 'job', 'metric',
+                         name='ix_changepoint_state_key'),
+    )
+    op.create_table(
+        "changepoints",
+        Column('id', Integer, primary_key=True),
+        Column('run_id', Integer, ForeignKey('runs.id', ondelete="CASCADE"), nullable=False),
+        Column('name', String),
+        Column('config', String),
+        Column('source', String),
+        Column('job', String),
+        Column('metric', String),
+        Column('before_kernel', String),
+        Column('after_kernel', String),
+        Column('before_mean', Float),
+        Column('after_mean', Float),
+        Column('regression', Boolean),
+    )
+    op.create_index('ix_changepoints_run_id', 'changepoints', ['run_id'])
+    op.create_index('ix_changepoints_name_config', 'changepoints',
+                    ['name', 'config'])
+
+
+def downgrade() -> None:
+    op.drop_table('changepoints')
+    op.drop_table('changepoint_state')
@@ -0,0 +1,43 @@
+"""results indexes
+
+Revision ID: e0b7d35c91af
+Revises: c5e2a9174b18
+Create Date: 2026-10-18 11:26:08.774310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = 'e0b7d35c91af'
+down_revision: Union[str, None] = 'c5e2a9174b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+result_tables = [
+    'fio_results',
+    'fio_time_series',
+    'fio_log_stats',
+    'time_results',
+    'dbench_results',
+    'fragmentation',
+    'io_stats',
+    'io_stats_series',
+    'latency_traces',
+    'btrfs_commit_stats',
+    'mount_timings',
+]
+
+
+def upgrade() -> None:
+    op.create_index('ix_runs_name_config_purpose_time', 'runs',
+                    ['name', 'config', 'purpose', 'time'])
+    for table in result_tables:
+        op.create_index(f'ix_{table}_run_id', table, ['run_id'])
+
+
+def downgrade() -> None:
+    for table in result_tables:
+        op.drop_index(f'ix_{table}_run_id', table)
+    op.drop_index('ix_runs_name_config_purpose_time', 'runs')
@@ -0,0 +1,29 @@
+"""run metrics recorded
+
+Revision ID: e8a4f17c3d60
+Revises: b5c08e7d2f41
+Create Date: 2026-10-19 10:52:19.064831
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Boolean, Column
+
+
+revision: str = 'e8a4f17c3d60'
+down_revision: Union[str, None] = 'b5c08e7d2f41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('metrics_recorded', Boolean, default=False))
+    # Runs without any rows get another look from metrics.backfill(), once
+    op.execute("UPDATE runs SET metrics_recorded = "
+               "(id IN (SELECT DISTINCT run_id FROM metrics))")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('metrics_recorded')
@@ -0,0 +1,92 @@
+import glob
+import os
+import numpy
+
+# fio names its logs <prefix>_<kind>.<jobnum>.log
+LOG_KINDS = ['bw', 'iops', 'lat']
+DDIRS = ['read', 'write', 'trim']
+
+def log_args(prefix, log_msec):
+    """The fio arguments to write averaged bw/iops/lat logs every log_msec"""
+    return (f" --write_bw_log={prefix} --write_iops_log={prefix}"
+            f" --write_lat_log={prefix} --log_avg_msec={log_msec}")
+
+def log_files(prefix, kind):
+    return glob.glob(f"{prefix}_{kind}.*.log")
+
+def remove_logs(prefix):
+    for f in glob.glob(f"{prefix}_*.log"):
+        os.unlink(f)
+
+def parse_logs(prefix, kind, log_msec):
+    """Merge the per-job logs of one kind into one series per data direction
+
+    The logs are streamed a line at a time and folded into log_msec wide
+    buckets, so memory use is bound by the length of the run rather than the
+    number of jobs or log entries.  bw and iops are summed across jobs, lat is
+    averaged.  Returns {ddir: numpy array of (time_ms, value)}.
+    """
+    sums = {}
+    counts = {}
+    for fname in log_files(prefix, kind):
+        with open(fname) as f:
+            for line in f:
+                fields = line.split(',')
+                if len(fields) < 3:
+                    continue
+                t = int(fields[0])
+                value = int(fields[1])
+                ddir = int(fields[2])
+                if ddir >= len(DDIRS):
+                    continue
+                bucket = (ddir, (t + log_msec // 2) // log_msec)
+                sums[bucket] = sums.get(bucket, 0) + value
+                counts[bucket] = counts.get(bucket, 0) + 1
+
+    ret = {}
+    for ddir in range(len(DDIRS)):
+        buckets = sorted(b for (d, b) in sums if d == ddir)
+        if not buckets:
+            continue
+        rows = []
+        for b in buckets:
+            value = sums[(ddir, b)]
+            if kind == 'lat':
+                value //= counts[(ddir, b)]
+            elif kind == 'bw':
+                # fio logs bandwidth in KiB/s
+                value *= 1024
+            rows.append((b * log_msec, value))
+        ret[DDIRS[ddir]] = numpy.array(rows, dtype=numpy.int64)
+    return ret
+
+def load_series(prefix, log_msec):
+    """All of the logged series for a run, keyed by e.g. 'write_bw'"""
+    series = {}
+    for kind in LOG_KINDS:
+        for ddir, s in parse_logs(prefix, kind, log_msec).items():
+            series[f"{ddir}_{kind}"] = s
+    return series
+
+def derive_stats(series):
+    """Steady state bandwidth and how fast it degrades over the run
+
+    Steady state is the mean bandwidth over the second half of the run.  The
+    slope is a least squares fit of bandwidth over time, expressed as the
+    percent of the mean bandwidth gained (or more likely lost) per minute.
+    """
+    stats = {}
+    for ddir in DDIRS:
+        s = series.get(f"{ddir}_bw")
+        if s is None or len(s) < 2:
+            continue
+        t = s[:, 0] / 1000
+        bw = s[:, 1].astype(numpy.float64)
+        mean = bw.mean()
+        stats[f"{ddir}_bw_steady_bytes"] = float(bw[len(bw) // 2:].mean())
+        if mean == 0:
+            stats[f"{ddir}_bw_slope_pct"] = 0.0
+            continue
+        slope = numpy.polyfit(t, bw, 1)[0]
+        stats[f"{ddir}_bw_slope_pct"] = float(slope * 60 * 100 / mean)
+    return stats
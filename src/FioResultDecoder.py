@@ -20,7 +20,10 @@ class FioResultDecoder(json.JSONDecoder):
         "write_bw": 1016,
 
     Currently any dict under 'jobs' get's dropped, with the exception of 'read',
-    'write', and 'trim'.  For those sub sections we drop any dict's under those.
+    'write', and 'trim'.  For those sub sections we drop any dict's under those,
+    except for 'lat_ns' and 'clat_ns'.  Their percentiles get flattened into
+    keys like "read_clat_ns_p99.9", and the json+ latency histogram is kept as
+    is under "read_clat_ns_bins".
 
     Attempt to keep this as generic as possible, we don't want to break every
     time fio changes it's json output format.
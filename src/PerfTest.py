@@ -1,9 +1,14 @@
+import FioLogs
 import FioResultDecoder
 import ResultData
+import aging
+import imagecache
 import utils
 import json
+import inspect
 from timeit import default_timer as timer
 import contextlib
+import fixtures
 
 RESULTS_DIR = "results"
 FRAG_DIR = "src/frag"
@@ -16,6 +21,11 @@ class PerfTest:
     skip_mkfs_and_mount = False
     end_state_umount_s = 0
     end_state_mount_s = 0
+    results_dir = RESULTS_DIR
+    aging = ""
+    # Shared setup this test only reads, see fixtures.py.  It's built in place
+    # of prefill() and reused by the next test with the same fixture.
+    fixture = None
 
     # Set this if the test does something specific and isn't going to use the
     # configuration options to change how the test is run.
@@ -26,16 +36,21 @@ class PerfTest:
             mnt.cycle_mount()
 
     def run(self, run, config, section, results):
+        self.results_dir = results
         with self.test_context(config, section):
             self.maybe_cycle_mount(self.mnt)
 
             if config.has_option(section, 'before'):
                 bg_proc = utils.run_bg_command(config.get(section, 'before'))
 
+            self.iostats_interval_ms = self.iostats_interval(config, section)
+            self.frag_interval_s = self.frag_interval(config, section)
             try:
-                with utils.IOStats(self.dev) as ios:
+                with utils.IOStats(self.dev, self.iostats_interval_ms) as ios:
                     with utils.LatencyTracing(self.what_latency_traces(config, section)) as lt:
-                        self.test(run, config, results)
+                        with utils.FragSampler(config, FRAG_DIR, self.results_dir,
+                                               self.frag_interval_s) as frag:
+                            self.test(run, config, results)
             finally:
                 if config.has_option(section, 'before'):
                     bg_proc.kill()
@@ -44,31 +59,148 @@ class PerfTest:
                     utils.run_command(config.get(section, 'after'))
 
             self.io_stats = ios.results()
+            self.io_stats_series = ios.series()
             self.latency_traces = lt.results()
+            self.frag_series = frag.series()
+            self.frag_peaks = frag.results()
             self.commit_stats = utils.collect_commit_stats(self.dev)
             self.end_state_umount_s, self.end_state_mount_s = self.mnt.timed_cycle_mount()
             self.collect_fragmentation(run, config)
+            run.aging = self.aging
             self.record_results(run)
 
-    # do generic setup (mkfs/mount), then test-specific setup.
+    # do generic setup (mkfs/mount/prefill), then test-specific setup.
     # use ExitStack to ensure we call umount/teardown appropriately
     def test_context(self, config, section):
-        self.dev = utils.mkfs(self, config, section)
+        base = self.aged_image(config, section)
+        image = self.cached_image(config, section, base)
+        live_key = self.fixture_key(config, section, base)
+        device = config.get(section, 'device', fallback=None)
+        reuse = live_key is not None and fixtures.is_live(device, live_key)
+        prefilled = image is not None and self.image_cache.has(image)
+        if reuse:
+            (self.dev, mount_cmd) = self.reuse_fixture(config, section)
+        else:
+            # Whatever was on the device isn't going to be there anymore
+            fixtures.forget(device)
+            if prefilled:
+                (self.dev, mount_cmd) = self.restore_image(config, section, image)
+            elif base is not None:
+                (self.dev, mount_cmd) = self.restore_image(config, section, base)
+            else:
+                (self.dev, mount_cmd) = self.make_fs(config, section)
         stack = contextlib.ExitStack()
-        if utils.want_mnt(self, config, section):
-            self.mnt = utils.Mount(
-                    config.get(section, 'mount'),
-                    config.get(section, 'device'),
-                    config.get('main', 'directory'))
+        if mount_cmd is not None:
+            self.mnt = utils.Mount(mount_cmd, device,
+                                   config.get('main', 'directory'))
             stack.enter_context(self.mnt)
+            if self.has_prefill() and not prefilled and not reuse:
+                self.prefill_fs(config, section, image)
+            if live_key is not None and not reuse:
+                self.freeze_fixture(device, live_key)
+            elif not self.mnt.live:
+                self.mnt.mount()
         self.setup(config, section)
-        stack.callback(self.teardown, config, RESULTS_DIR)
+        stack.callback(self.teardown, config, self.results_dir)
         return stack
 
+    # The ways test_context() gets a fs onto the device, each returns the
+    # device and the command to mount it with, or None to leave it unmounted
+
+    def reuse_fixture(self, config, section):
+        print("\tReusing fixture {}".format(self.fixture.name))
+        utils.drop_caches()
+        return (config.get(section, 'device'),
+                fixtures.ro_mount(config.get(section, 'mount')))
+
+    def restore_image(self, config, section, image):
+        device = config.get(section, 'device')
+        print("\tRestoring cached image {}".format(image))
+        self.image_cache.restore(image, device)
+        return (device, config.get(section, 'mount'))
+
+    def make_fs(self, config, section):
+        mount_cmd = None
+        if utils.want_mnt(self, config, section):
+            mount_cmd = config.get(section, 'mount')
+        return (utils.mkfs(self, config, section), mount_cmd)
+
+    # Leaves the fs unmounted, so the test starts from a cold mount same as
+    # with a restored image
+    def prefill_fs(self, config, section, image):
+        self.prefill(config, section)
+        self.mnt.umount()
+        if image is not None:
+            self.image_cache.save(self.dev, image)
+
+    def freeze_fixture(self, device, live_key):
+        # From here on nothing may change the fixture
+        self.mnt.umount()
+        self.mnt.mount_cmd = fixtures.ro_mount(self.mnt.mount_cmd)
+        utils.drop_caches()
+        self.mnt.mount()
+        fixtures.set_live(device, live_key)
+
     # override for special per-test setup
     def setup(self, config, section):
         pass
 
+    # override to fill the fs before the test, i.e. laying out files that the
+    # test only reads.  This runs on the freshly mounted fs before setup(), and
+    # with image_cache set the result is saved the first time and restored
+    # after that instead of running mkfs and prefill again.
+    def prefill(self, config, section):
+        if self.fixture is not None:
+            self.fixture.build(config, section)
+
+    def has_prefill(self):
+        return (self.fixture is not None or
+                type(self).prefill is not PerfTest.prefill)
+
+    # Anything prefill does differently needs to change this, so that it gets
+    # a new image
+    def prefill_fingerprint(self):
+        if self.fixture is not None:
+            return self.fixture.fingerprint()
+        return inspect.getsource(type(self).prefill) + self.command
+
+    # Tests with the same fixture share the image and the fs on the device
+    def prefill_name(self):
+        if self.fixture is not None:
+            return self.fixture.name
+        return self.name
+
+    def fixture_key(self, config, section, base=None):
+        if not (self.fixture is not None and
+                utils.want_mkfs(self, config, section) and
+                utils.want_mnt(self, config, section)):
+            return None
+        return (section, self.fixture.name, self.fixture.fingerprint(), base)
+
+    def cached_image(self, config, section, base=None):
+        self.image_cache = imagecache.ImageCache(config)
+        if not (self.image_cache.enabled() and self.has_prefill() and
+                utils.want_mkfs(self, config, section) and
+                utils.want_mnt(self, config, section) and
+                imagecache.cacheable(config, section)):
+            return None
+        return self.image_cache.key(config.get(section, 'mkfs'),
+                                    config.get(section, 'mount'),
+                                    imagecache.device_size(config.get(section, 'device')),
+                                    self.prefill_name(), self.prefill_fingerprint(),
+                                    base)
+
+    # The image of the section's aged fs to start from instead of mkfs, see
+    # aging.py
+    def aged_image(self, config, section):
+        self.aging = ""
+        if not (config.has_option(section, 'age') and
+                utils.want_mkfs(self, config, section) and
+                utils.want_mnt(self, config, section)):
+            return None
+        self.aging = config.get(section, 'age')
+        return aging.aged_image(config, section, FRAG_DIR, self.results_dir)
+
     def record_results(self, run):
         for lt in self.latency_traces:
             ltr = ResultData.LatencyTrace()
@@ -77,11 +209,20 @@ class PerfTest:
         ios = ResultData.IOStats()
         ios.load_from_dict(self.io_stats)
         run.io_stats.append(ios)
+        if self.io_stats_series is not None:
+            series = ResultData.IOStatsSeries(self.iostats_interval_ms,
+                                              self.io_stats_series)
+            run.io_stats_series.append(series)
         mt = ResultData.MountTiming(self.end_state_umount_s, self.end_state_mount_s)
         run.mount_timings.append(mt)
         f = ResultData.Fragmentation()
         f.load_from_dict(self.fragmentation)
+        f.load_from_dict(self.frag_peaks)
         run.fragmentation.append(f)
+        if self.frag_series is not None:
+            series = ResultData.FragmentationSeries(self.frag_interval_s * 1000,
+                                                    self.frag_series)
+            run.fragmentation_series.append(series)
         if self.commit_stats and 'commits' in self.commit_stats:
             stats = ResultData.BtrfsCommitStats()
             stats.load_from_dict(self.commit_stats)
@@ -96,24 +237,19 @@ class PerfTest:
         pass
 
     def collect_fragmentation(self, run, config):
-        bg_dump_filename = f"{RESULTS_DIR}/bgs.txt"
-        utils.generate_bg_dump(config, FRAG_DIR)
-        with open(bg_dump_filename, 'w') as f:
-            try:
-                utils.run_command(f"btrd {FRAG_DIR}/bg-dump.btrd", f)
-            except Exception as e:
-                print(f"failed to collect fragmentation data: {e}. (Likely, running the btrd script OOMed)")
-                self.fragmentation = {}
-                return
-        frag_filename = f"{RESULTS_DIR}/{self.name}.frag"
-        with open(frag_filename, 'w') as f:
-            try:
-                utils.run_command(f"{FRAG_DIR}/target/release/btrfs-frag-view {RESULTS_DIR}/bgs.txt", f)
-            except Exception as e:
-                print(f"failed to analyze fragmentation data: {e}.")
-                self.fragmentation = {}
-                return
-        self.fragmentation = json.load(open(frag_filename))
+        self.fragmentation = utils.measure_fragmentation(config, FRAG_DIR,
+                                                         self.results_dir,
+                                                         self.name)
+
+    # How often to snapshot the fragmentation during the test in seconds, 0
+    # disables it.  Each one walks the whole extent tree and skews the
+    # results, so it's off unless the section asks for it.
+    def frag_interval(self, config, section):
+        return config.getint(section, 'frag_interval', fallback=0)
+
+    # How often to sample the device stats during the test, 0 disables it
+    def iostats_interval(self, config, section):
+        return config.getint(section, 'iostats_interval', fallback=100)
 
     def what_latency_traces(self, config, section):
         trace_fns = ""
@@ -124,25 +260,60 @@ class PerfTest:
         return [fn for fn in trace_fns.split(",") if fn]
 
 class FioTest(PerfTest):
+    # Set this (or fio_log_msec in the config section) to have fio log
+    # bw/iops/lat averaged over this many ms, and store them as time series.
+    fio_log_msec = 0
+
+    def run(self, run, config, section, results):
+        self.results_dir = results
+        self.fio_log_msec = config.getint(section, 'fio_log_msec',
+                                          fallback=type(self).fio_log_msec)
+        FioLogs.remove_logs(self.log_prefix())
+        PerfTest.run(self, run, config, section, results)
+
+    def log_prefix(self):
+        return "{}/{}".format(self.results_dir, self.name)
+
     def record_results(self, run):
         PerfTest.record_results(self, run)
-        json_data = open("{}/{}.json".format(RESULTS_DIR, self.name))
+        json_data = open("{}/{}.json".format(self.results_dir, self.name))
         data = json.load(json_data, cls=FioResultDecoder.FioResultDecoder)
         for j in data['jobs']:
             r = ResultData.FioResult()
             r.load_from_dict(j)
             run.fio_results.append(r)
+        if self.fio_log_msec:
+            self.record_time_series(run)
+
+    def record_time_series(self, run):
+        series = FioLogs.load_series(self.log_prefix(), self.fio_log_msec)
+        for metric, s in series.items():
+            ts = ResultData.FioTimeSeries(metric, self.fio_log_msec, s)
+            run.fio_time_series.append(ts)
+        stats = FioLogs.derive_stats(series)
+        if stats:
+            r = ResultData.FioLogStats()
+            r.load_from_dict(stats)
+            run.fio_log_stats.append(r)
+        FioLogs.remove_logs(self.log_prefix())
 
     def default_cmd(self, results):
-        command = "fio --output-format=json"
-        command += " --output={}/{}.json".format(RESULTS_DIR, self.name)
+        command = "fio --output-format=json+"
+        command += " --output={}/{}.json".format(results, self.name)
         command += " --alloc-size 98304 --allrandrepeat=1 --randseed=12345 --group_reporting=1"
+        command += " --clat_percentiles=1 --lat_percentiles=1"
+        command += " --percentile_list={}".format(
+                ":".join(str(p) for p in ResultData.FIO_PERCENTILES))
+        if self.fio_log_msec:
+            command += FioLogs.log_args(self.log_prefix(), self.fio_log_msec)
         return command
 
     def test(self, run, config, results):
         directory = config.get('main', 'directory')
         command = self.default_cmd(results)
         command += " --directory {} ".format(directory)
+        if isinstance(self.fixture, fixtures.FioLayout):
+            command += self.fixture.fio_args()
         command += self.command
         utils.run_command(command)
 
@@ -170,7 +341,7 @@ class DbenchTest(PerfTest):
     def test(self, run, config, results):
         directory = config.get('main', 'directory')
         command = "dbench " + self.command + " -D {}".format(directory)
-        fd = open("{}/{}.txt".format(RESULTS_DIR, self.name), "w+")
+        fd = open("{}/{}.txt".format(results, self.name), "w+")
         utils.run_command(command, fd)
         fd.seek(0)
         parse = False
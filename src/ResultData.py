@@ -1,15 +1,20 @@
 import datetime
+import numpy
 import numbers
 import socket
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import (Table, Column, Integer, String, ForeignKey, DateTime,
-                        Float)
+                        Float, LargeBinary, Index, Date, UniqueConstraint,
+                        Boolean, BigInteger)
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
 class Run(Base):
     __tablename__ = "runs"
+    # Every results lookup filters on some prefix of these
+    __table_args__ = (Index('ix_runs_name_config_purpose_time',
+                            'name', 'config', 'purpose', 'time'),)
 
     id = Column(Integer, primary_key=True)
     kernel = Column(String)
@@ -18,6 +23,20 @@ class Run(Base):
     hostname = Column(String, default=socket.gethostname())
     purpose = Column(String, default="continuous")
     time = Column(DateTime, default=datetime.datetime.utcnow)
+    # config groups that were running at the same time, see fsperf -j
+    overlapped = Column(String, default="")
+    # how many times this test was run in a row, and with --target-ci the
+    # confidence interval of its regression keys that it got to
+    nr_runs = Column(Integer, default=1)
+    ci_pct = Column(Float)
+    # the section's age= profile if the test ran on an aged fs
+    aging = Column(String, default="")
+    # set once metrics.py has copied this run's results into metrics
+    metrics_recorded = Column(Boolean, default=False)
+    # set once rollup.py has folded this run into the metric rollups
+    rolled_up = Column(Boolean, default=False)
+    # set once changepoints.py has fed this run's metrics to the detector
+    changepoints_done = Column(Boolean, default=False)
 
     time_results = relationship("TimeResult", backref="runs",
                                 order_by="TimeResult.id",
@@ -37,6 +56,12 @@ class Run(Base):
     io_stats = relationship("IOStats", backref="runs",
                             order_by="IOStats.id",
                             cascade="all,delete")
+    metrics = relationship("Metric", backref="runs",
+                           order_by="Metric.id",
+                           cascade="all,delete")
+    io_stats_series = relationship("IOStatsSeries", backref="runs",
+                                   order_by="IOStatsSeries.id",
+                                   cascade="all,delete")
     btrfs_commit_stats = relationship("BtrfsCommitStats",
                                       backref="runs",
                                       order_by="BtrfsCommitStats.id",
@@ -44,6 +69,45 @@ class Run(Base):
     mount_timings = relationship("MountTiming", backref="runs",
                                   order_by="MountTiming.id",
                                   cascade="all,delete")
+    fio_time_series = relationship("FioTimeSeries", backref="runs",
+                                   order_by="FioTimeSeries.id",
+                                   cascade="all,delete")
+    fio_log_stats = relationship("FioLogStats", backref="runs",
+                                 order_by="FioLogStats.id",
+                                 cascade="all,delete")
+    fragmentation_series = relationship("FragmentationSeries", backref="runs",
+                                        order_by="FragmentationSeries.id",
+                                        cascade="all,delete")
+
+# The completion/total latency percentiles we ask fio for, and store for every
+# job as one packed vector per FIO_PERCENTILE_SERIES entry.
+FIO_PERCENTILES = [1, 10, 50, 90, 95, 99, 99.5, 99.9, 99.95, 99.99]
+FIO_PERCENTILE_SERIES = ['read_clat_ns', 'read_lat_ns',
+                         'write_clat_ns', 'write_lat_ns']
+
+def fio_percentile_key(series, p):
+    p = float(p)
+    if p.is_integer():
+        p = int(p)
+    return f"{series}_p{p}"
+
+def pack_array(a):
+    return numpy.asarray(a).astype('<i8').tobytes()
+
+def unpack_array(b, nr_fields):
+    return numpy.frombuffer(b, dtype='<i8').reshape(-1, nr_fields)
+
+def pack_float_array(a):
+    return numpy.asarray(a).astype('<f8').tobytes()
+
+def unpack_float_array(b, nr_fields):
+    return numpy.frombuffer(b, dtype='<f8').reshape(-1, nr_fields)
+
+# The relationships of a Run that hold its results, these all get loaded
+# together whenever we look at a run's results.
+RESULT_RELATIONSHIPS = ['time_results', 'fio_results', 'dbench_results',
+                        'fragmentation', 'latency_traces', 'io_stats',
+                        'btrfs_commit_stats', 'mount_timings', 'fio_log_stats']
 
 def is_stat(key, value):
     return not "id" in key and isinstance(value, numbers.Number)
@@ -55,28 +119,107 @@ class FioResult(Base):
     __tablename__ = 'fio_results'
 
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
-    read_io_bytes = Column(Integer, default=0)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    jobname = Column(String)
+    read_io_bytes = Column(BigInteger, default=0)
     elapsed = Column(Integer, default=0)
     sys_cpu = Column(Float, default=0.0)
-    read_lat_ns_min = Column(Integer, default=0)
-    read_lat_ns_max = Column(Integer, default=0)
-    read_lat_ns_mean = Column(Integer, default=0)
-    read_clat_ns_p50 = Column(Integer, default=0)
-    read_clat_ns_p99 = Column(Integer, default=0)
-    read_clat_ns_mean = Column(Integer, default=0)
+    read_lat_ns_min = Column(BigInteger, default=0)
+    read_lat_ns_max = Column(BigInteger, default=0)
+    read_lat_ns_mean = Column(BigInteger, default=0)
+    read_clat_ns_p50 = Column(BigInteger, default=0)
+    read_clat_ns_p99 = Column(BigInteger, default=0)
+    read_clat_ns_mean = Column(BigInteger, default=0)
     read_iops = Column(Float, default=0)
-    read_io_kbytes = Column(Integer, default=0)
-    read_bw_bytes = Column(Integer, default=0)
-    write_lat_ns_min = Column(Integer, default=0)
-    write_lat_ns_max = Column(Integer, default=0)
-    write_lat_ns_mean = Column(Integer, default=0)
-    write_clat_ns_p50 = Column(Integer, default=0)
-    write_clat_ns_p99 = Column(Integer, default=0)
-    write_clat_ns_mean = Column(Integer, default=0)
+    read_io_kbytes = Column(BigInteger, default=0)
+    read_bw_bytes = Column(BigInteger, default=0)
+    write_lat_ns_min = Column(BigInteger, default=0)
+    write_lat_ns_max = Column(BigInteger, default=0)
+    write_lat_ns_mean = Column(BigInteger, default=0)
+    write_clat_ns_p50 = Column(BigInteger, default=0)
+    write_clat_ns_p99 = Column(BigInteger, default=0)
+    write_clat_ns_mean = Column(BigInteger, default=0)
     write_iops = Column(Float, default=0.0)
-    write_io_kbytes = Column(Integer, default=0)
-    write_bw_bytes = Column(Integer, default=0)
+    write_io_kbytes = Column(BigInteger, default=0)
+    write_bw_bytes = Column(BigInteger, default=0)
+
+    # FIO_PERCENTILES for each of FIO_PERCENTILE_SERIES
+    percentiles = Column(LargeBinary)
+    # fio's own log/linear latency buckets from json+, as (ns, count) pairs
+    read_clat_hist = Column(LargeBinary)
+    write_clat_hist = Column(LargeBinary)
+
+    def load_from_dict(self, inval):
+        for k in dir(self):
+            if k not in inval:
+                continue
+            setattr(self, k, inval[k])
+        vec = [[inval.get(fio_percentile_key(series, p), 0)
+                for p in FIO_PERCENTILES]
+               for series in FIO_PERCENTILE_SERIES]
+        self.percentiles = pack_array(vec)
+        for ddir in ['read', 'write']:
+            bins = inval.get(f"{ddir}_clat_ns_bins")
+            if not bins:
+                continue
+            hist = sorted((int(ns), count) for ns, count in bins.items())
+            setattr(self, f"{ddir}_clat_hist", pack_array(hist))
+
+    def percentile_vector(self, series):
+        if self.percentiles is None:
+            return None
+        vec = unpack_array(self.percentiles, len(FIO_PERCENTILES))
+        return vec[FIO_PERCENTILE_SERIES.index(series)]
+
+    def clat_hist(self, ddir):
+        hist = getattr(self, f"{ddir}_clat_hist")
+        if hist is None:
+            return None
+        return unpack_array(hist, 2)
+
+    def to_dict(self):
+        ret = result_to_dict(self)
+        if self.percentiles is None:
+            return ret
+        for series in FIO_PERCENTILE_SERIES:
+            vec = self.percentile_vector(series)
+            for p, v in zip(FIO_PERCENTILES, vec):
+                k = fio_percentile_key(series, p)
+                if k not in ret:
+                    ret[k] = int(v)
+        return ret
+
+# One of fio's periodic bw/iops/lat logs, merged across jobs.  Each row of
+# samples is (time_ms, value), packed like IOStatsSeries.
+class FioTimeSeries(Base):
+    __tablename__ = 'fio_time_series'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    metric = Column(String)
+    interval_ms = Column(Integer, default=0)
+    samples = Column(LargeBinary)
+
+    def __init__(self, metric, interval_ms, series):
+        self.metric = metric
+        self.interval_ms = interval_ms
+        self.samples = pack_array(series)
+
+    def to_array(self):
+        return unpack_array(self.samples, 2)
+
+class FioLogStats(Base):
+    __tablename__ = 'fio_log_stats'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    read_bw_steady_bytes = Column(Float, default=0.0)
+    read_bw_slope_pct = Column(Float, default=0.0)
+    write_bw_steady_bytes = Column(Float, default=0.0)
+    write_bw_slope_pct = Column(Float, default=0.0)
+    trim_bw_steady_bytes = Column(Float, default=0.0)
+    trim_bw_slope_pct = Column(Float, default=0.0)
 
     def load_from_dict(self, inval):
         for k in dir(self):
@@ -90,7 +233,8 @@ class FioResult(Base):
 class TimeResult(Base):
     __tablename__ = 'time_results'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
     elapsed = Column(Float, default=0.0)
 
     def to_dict(self):
@@ -99,7 +243,8 @@ class TimeResult(Base):
 class DbenchResult(Base):
     __tablename__ = 'dbench_results'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
     throughput = Column(Float, default=0.0)
     ntcreatex = Column(Float, default=0.0)
     close = Column(Float, default=0.0)
@@ -130,7 +275,8 @@ class DbenchResult(Base):
 class Fragmentation(Base):
     __tablename__ = 'fragmentation'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
     bg_count = Column(Integer, default=0)
     fragmented_bg_count = Column(Integer, default=0)
     frag_pct_mean = Column(Float, default=0.0)
@@ -139,6 +285,10 @@ class Fragmentation(Base):
     frag_pct_p95 = Column(Float, default=0.0)
     frag_pct_p99 = Column(Float, default=0.0)
     frag_pct_max = Column(Float, default=0.0)
+    # the highest they got while the test ran, with frag_interval set
+    peak_frag_pct_p50 = Column(Float)
+    peak_frag_pct_p95 = Column(Float)
+    peak_frag_pct_max = Column(Float)
 
     def load_from_dict(self, inval):
         for k in dir(self):
@@ -152,11 +302,15 @@ class Fragmentation(Base):
 class IOStats(Base):
     __tablename__ = 'io_stats'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
     dev_read_iops = Column(Integer, default=0)
-    dev_read_kbytes = Column(Integer, default=0)
+    dev_read_kbytes = Column(BigInteger, default=0)
     dev_write_iops = Column(Integer, default=0)
-    dev_write_kbytes = Column(Integer, default=0)
+    dev_write_kbytes = Column(BigInteger, default=0)
+    dev_kbytes_per_sec_p50 = Column(Float, default=0.0)
+    dev_kbytes_per_sec_p99 = Column(Float, default=0.0)
+    dev_max_stall_ms = Column(Integer, default=0)
 
     def load_from_dict(self, inval):
         for k in dir(self):
@@ -167,10 +321,51 @@ class IOStats(Base):
     def to_dict(self):
         return result_to_dict(self)
 
+# The fragmentation snapshots taken while the test ran, see
+# utils.FRAG_SAMPLE_FIELDS for the layout of each row.  Packed like
+# IOStatsSeries, but as floats.
+class FragmentationSeries(Base):
+    __tablename__ = 'fragmentation_series'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    interval_ms = Column(Integer, default=0)
+    nr_fields = Column(Integer, default=0)
+    samples = Column(LargeBinary)
+
+    def __init__(self, interval_ms, series):
+        self.interval_ms = interval_ms
+        self.nr_fields = series.shape[1]
+        self.samples = pack_float_array(series)
+
+    def to_array(self):
+        return unpack_float_array(self.samples, self.nr_fields)
+
+# The per-interval device samples taken while the test ran, see
+# utils.IOSTAT_SAMPLE_FIELDS for the layout of each row.  These are packed into
+# a single blob per run rather than a row per sample to keep the db small.
+class IOStatsSeries(Base):
+    __tablename__ = 'io_stats_series'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    interval_ms = Column(Integer, default=0)
+    nr_fields = Column(Integer, default=0)
+    samples = Column(LargeBinary)
+
+    def __init__(self, interval_ms, series):
+        self.interval_ms = interval_ms
+        self.nr_fields = series.shape[1]
+        self.samples = pack_array(series)
+
+    def to_array(self):
+        return unpack_array(self.samples, self.nr_fields)
+
 class LatencyTrace(Base):
     __tablename__ = 'latency_traces'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
     function = Column(String)
     ns_mean = Column(Float, default=0.0)
     ns_min = Column(Float, default=0.0)
@@ -193,7 +388,8 @@ class LatencyTrace(Base):
 class BtrfsCommitStats(Base):
     __tablename__ = 'btrfs_commit_stats'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
     commits = Column(Integer, default=0)
     avg_commit_ms = Column(Float, default=0.0)
     max_commit_ms = Column(Integer, default=0)
@@ -210,9 +406,10 @@ class BtrfsCommitStats(Base):
 class MountTiming(Base):
     __tablename__ = 'mount_timings'
     id = Column(Integer, primary_key=True)
-    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False)
-    end_state_umount_ns = Column(Integer, default=0)
-    end_state_mount_ns = Column(Integer, default=0)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    end_state_umount_ns = Column(BigInteger, default=0)
+    end_state_mount_ns = Column(BigInteger, default=0)
 
     def __init__(self, umount, mount):
         self.end_state_umount_ns = umount
@@ -220,3 +417,91 @@ class MountTiming(Base):
 
     def to_dict(self):
         return result_to_dict(self)
+
+# Per day aggregates of every metric, maintained by rollup.py
+class MetricRollup(Base):
+    __tablename__ = 'metric_rollups'
+    __table_args__ = (UniqueConstraint('name', 'config', 'purpose', 'day',
+                                       'metric',
+                                       name='ix_metric_rollups_key'),)
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    config = Column(String)
+    purpose = Column(String)
+    metric = Column(String)
+    day = Column(Date)
+    count = Column(Integer, default=0)
+    # Welford's running mean and sum of squared differences from it, a plain
+    # sum of squares loses everything to cancellation for byte and ns metrics
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0)
+    min = Column(Float)
+    max = Column(Float)
+
+# Long format copy of every run's results, see metrics.py
+class Metric(Base):
+    __tablename__ = 'metrics'
+    __table_args__ = (Index('ix_metrics_metric_run_id', 'metric', 'run_id'),)
+    id = Column(Integer, primary_key=True)
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    source = Column(String)
+    job = Column(String)
+    metric = Column(String)
+    value = Column(Float)
+
+# One (test, config, kernel, run index) for fsperf --worker to run, see
+# distributed.py
+class WorkItem(Base):
+    __tablename__ = 'work_items'
+    __table_args__ = (Index('ix_work_items_state_kernel', 'state', 'kernel'),)
+    id = Column(Integer, primary_key=True)
+    batch = Column(String, index=True)
+    test = Column(String)
+    config = Column(String)
+    kernel = Column(String)
+    purpose = Column(String)
+    run_index = Column(Integer)
+    state = Column(String, default="pending")
+    hostname = Column(String)
+    claimed = Column(DateTime)
+    finished = Column(DateTime)
+    run_id = Column(ForeignKey('runs.id', ondelete="SET NULL"))
+    error = Column(String)
+
+# Where changepoints.py has gotten to in every continuous metric series, the
+# points since the last change point are kept to test the next one against.
+class ChangePointState(Base):
+    __tablename__ = 'changepoint_state'
+    __table_args__ = (UniqueConstraint('name', 'config', 'source', 'job',
+                                       'metric',
+                                       name='ix_changepoint_state_key'),)
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    config = Column(String)
+    source = Column(String)
+    job = Column(String)
+    metric = Column(String)
+    last_run_id = Column(Integer, default=0)
+    run_ids = Column(LargeBinary)
+    values = Column(LargeBinary)
+    # run times in us since the epoch, to put late runs in their place
+    times = Column(LargeBinary)
+
+class ChangePoint(Base):
+    __tablename__ = 'changepoints'
+    __table_args__ = (Index('ix_changepoints_name_config', 'name', 'config'),)
+    id = Column(Integer, primary_key=True)
+    # The first run after the change
+    run_id = Column(ForeignKey('runs.id', ondelete="CASCADE"), nullable=False,
+                    index=True)
+    name = Column(String)
+    config = Column(String)
+    source = Column(String)
+    job = Column(String)
+    metric = Column(String)
+    before_kernel = Column(String)
+    after_kernel = Column(String)
+    before_mean = Column(Float)
+    after_mean = Column(Float)
+    regression = Column(Boolean)
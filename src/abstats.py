@@ -0,0 +1,225 @@
+import math
+import warnings
+import numpy as np
+import utils
+
+# A/B comparison of two sets of runs, every metric at once.  The runs are
+# turned into a runs x metrics matrix (NaN where a run doesn't have a metric)
+# and each step works on whole columns, so it doesn't matter much how many
+# metrics or runs there are.  For every metric we get
+#
+#  * a two sample test, Welch's t-test or Mann-Whitney U, for a p-value
+#  * Benjamini-Hochberg q-values, so that with a few hundred metrics we don't
+#    flag a dozen of them just by chance
+#  * a bootstrap 95% confidence interval of the % change in the mean
+#  * Hedges' g, the change in units of the pooled stdev
+#
+# With a single run on one side there's no spread to measure for it, so it's
+# assumed to be the same as the other side's, which makes the test check
+# whether the one run falls outside of what the other side would predict.
+
+ALPHA = 0.05
+BOOTSTRAP_SAMPLES = 2000
+METHODS = ['welch', 'mwu']
+
+class quiet(warnings.catch_warnings):
+    """Silence numpy's empty slice and divide by zero warnings, NaNs and infs
+    are expected for metrics with too few runs."""
+    def __enter__(self):
+        ret = super().__enter__()
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        self.errstate = np.errstate(all='ignore')
+        self.errstate.__enter__()
+        return ret
+
+    def __exit__(self, *exc):
+        self.errstate.__exit__(*exc)
+        return super().__exit__(*exc)
+
+def value_matrix(results, keys):
+    m = np.full((len(results), len(keys)), np.nan)
+    index = {k: j for j, k in enumerate(keys)}
+    for i, run in enumerate(results):
+        for k, v in utils.results_to_dict(run).items():
+            m[i, index[k]] = v
+    return m
+
+def column_stats(m):
+    n = np.sum(~np.isnan(m), axis=0)
+    with quiet():
+        mean = np.nanmean(m, axis=0)
+        var = np.nanvar(m, axis=0, ddof=1)
+    return (n, mean, np.where(n > 1, var, np.nan))
+
+lgamma = np.vectorize(math.lgamma, otypes=[float])
+
+def betacf(a, b, x, iters=200):
+    """Continued fraction for the incomplete beta function (Lentz)"""
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = np.ones_like(x)
+    d = 1 - qab * x / qap
+    d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+    h = d
+    for i in range(1, iters + 1):
+        i2 = 2 * i
+        for aa in (i * (b - i) * x / ((qam + i2) * (a + i2)),
+                   -(a + i) * (qab + i) * x / ((a + i2) * (qap + i2))):
+            d = 1 + aa * d
+            d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+            c = 1 + aa / c
+            c = np.where(np.abs(c) < tiny, tiny, c)
+            h = h * d * c
+    return h
+
+def betainc(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)"""
+    x = np.clip(x, 0.0, 1.0)
+    with quiet():
+        front = np.exp(lgamma(a + b) - lgamma(a) - lgamma(b) +
+                       a * np.log(x) + b * np.log1p(-x))
+        direct = front * betacf(a, b, x) / a
+        flipped = 1 - front * betacf(b, a, 1 - x) / b
+    ret = np.where(x < (a + 1) / (a + b + 2), direct, flipped)
+    ret = np.where(x == 0, 0.0, ret)
+    return np.where(x == 1, 1.0, ret)
+
+def t_pvalue(t, df):
+    """Two sided p-value of Student's t"""
+    with quiet():
+        x = df / (df + t * t)
+    x = np.where(np.isinf(t), 0.0, x)
+    return np.where(np.isnan(t) | np.isnan(df), np.nan,
+                    betainc(df / 2, np.full_like(df, 0.5), x))
+
+def welch(a, b):
+    na, ma, va = column_stats(a)
+    nb, mb, vb = column_stats(b)
+    va, vb = np.where(na == 1, vb, va), np.where(nb == 1, va, vb)
+    with quiet():
+        sa = va / na
+        sb = vb / nb
+        t = (mb - ma) / np.sqrt(sa + sb)
+        df = (sa + sb) ** 2 / (np.where(na > 1, sa * sa / (na - 1), 0) +
+                               np.where(nb > 1, sb * sb / (nb - 1), 0))
+    # No spread on either side, either it moved or it didn't
+    t = np.where(ma == mb, 0.0, t)
+    df = np.where(np.isnan(df) & (na + nb > 2), 1.0, df)
+    return t_pvalue(t, df)
+
+def rankdata(v):
+    """Ranks starting from 1, ties get the average of their ranks"""
+    _, inverse, counts = np.unique(v, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    return (ends - (counts - 1) / 2)[inverse], counts
+
+def mannwhitney(a, b):
+    p = np.full(a.shape[1], np.nan)
+    for j in range(a.shape[1]):
+        x = a[:, j][~np.isnan(a[:, j])]
+        y = b[:, j][~np.isnan(b[:, j])]
+        if len(x) == 0 or len(y) == 0 or len(x) + len(y) < 3:
+            continue
+        ranks, ties = rankdata(np.concatenate([x, y]))
+        n = len(x) + len(y)
+        u = ranks[:len(x)].sum() - len(x) * (len(x) + 1) / 2
+        mu = len(x) * len(y) / 2
+        sigma2 = len(x) * len(y) / 12 * ((n + 1) -
+                                         (ties ** 3 - ties).sum() / (n * (n - 1)))
+        if sigma2 <= 0:
+            p[j] = 1.0
+            continue
+        z = max(abs(u - mu) - 0.5, 0) / math.sqrt(sigma2)
+        p[j] = math.erfc(z / math.sqrt(2))
+    return p
+
+def bootstrap_means(rng, m, samples):
+    # Resampling a set of runs is the same as giving each one a count of how
+    # many times it was picked, so do all of the samples as one matmul.
+    n = m.shape[0]
+    counts = rng.multinomial(n, np.full(n, 1.0 / n), size=samples)
+    present = ~np.isnan(m)
+    with quiet():
+        return (counts @ np.where(present, m, 0)) / (counts @ present)
+
+def bootstrap_ci(a, b, samples=BOOTSTRAP_SAMPLES, seed=0):
+    """95% confidence interval of the % change of the mean from a to b"""
+    rng = np.random.default_rng(seed)
+    ma = bootstrap_means(rng, a, samples)
+    mb = bootstrap_means(rng, b, samples)
+    with quiet():
+        delta = (mb - ma) / np.abs(ma) * 100
+        delta[~np.isfinite(delta)] = np.nan
+        lo, hi = np.nanpercentile(delta, [2.5, 97.5], axis=0)
+    return (lo, hi)
+
+def hedges_g(a, b):
+    na, ma, va = column_stats(a)
+    nb, mb, vb = column_stats(b)
+    with quiet():
+        pooled = (np.where(na > 1, (na - 1) * va, 0) +
+                  np.where(nb > 1, (nb - 1) * vb, 0)) / (na + nb - 2)
+        g = (mb - ma) / np.sqrt(pooled)
+        g = g * (1 - 3 / (4 * (na + nb) - 9))
+    g[~np.isfinite(g)] = np.nan
+    return g
+
+def bh_qvalues(p):
+    """Benjamini-Hochberg adjusted p-values, NaNs are left out"""
+    q = np.full_like(p, np.nan)
+    ok = ~np.isnan(p)
+    ps = p[ok]
+    if len(ps) == 0:
+        return q
+    order = np.argsort(ps)
+    ranked = ps[order] * len(ps) / np.arange(1, len(ps) + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = np.empty_like(ps)
+    adjusted[order] = np.minimum(ranked, 1.0)
+    q[ok] = adjusted
+    return q
+
+def compare(results_A, results_B, method='welch', alpha=ALPHA):
+    """Compare two lists of runs, returns a dict per metric sorted by name"""
+    keys = set()
+    for run in results_A + results_B:
+        keys.update(utils.results_to_dict(run).keys())
+    keys = sorted(keys)
+    a = value_matrix(results_A, keys)
+    b = value_matrix(results_B, keys)
+    if method == 'mwu':
+        p = mannwhitney(a, b)
+    else:
+        p = welch(a, b)
+    q = bh_qvalues(p)
+    lo, hi = bootstrap_ci(a, b)
+    g = hedges_g(a, b)
+    na, ma, va = column_stats(a)
+    nb, mb, vb = column_stats(b)
+
+    ret = []
+    for j, k in enumerate(keys):
+        if na[j] == 0 or nb[j] == 0:
+            continue
+        if not ma[j] and not mb[j]:
+            continue
+        higher_better = utils.metric_direction(k) == utils.HIGHER_IS_BETTER
+        significant = bool(q[j] < alpha)
+        ret.append({
+            'metric': k,
+            'mean_A': ma[j],
+            'mean_B': mb[j],
+            'stdev_A': math.sqrt(va[j]) if na[j] > 1 else 0,
+            'diff': utils.pct_diff(ma[j], mb[j]),
+            'ci_lo': lo[j],
+            'ci_hi': hi[j],
+            'p': p[j],
+            'q': q[j],
+            'effect': g[j],
+            'significant': significant,
+            'better': significant and bool((mb[j] > ma[j]) == higher_better),
+            'worse': significant and bool((mb[j] > ma[j]) != higher_better),
+        })
+    return ret
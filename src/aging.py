@@ -0,0 +1,79 @@
+import os
+import imagecache
+import utils
+
+# Running the normal tests on an aged filesystem instead of a fresh one.  A
+# section with age=WORKLOAD:TARGET[:ROUNDS] first replays the named frag_tests
+# workload on a fresh fs, round after round, until btrfs-frag-view's
+# frag_pct_p50 reaches TARGET (or ROUNDS rounds have run).  The aged fs is
+# saved with the image cache, and every test in the section starts from a copy
+# of it instead of mkfs.
+
+FRAG_TEST_DIR = "frag_tests/"
+DEFAULT_ROUNDS = 20
+
+class Profile:
+    def __init__(self, spec):
+        parts = spec.split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f"age must be WORKLOAD:TARGET[:ROUNDS], not '{spec}'")
+        self.workload = parts[0]
+        self.target = float(parts[1])
+        self.rounds = int(parts[2]) if len(parts) == 3 else DEFAULT_ROUNDS
+        self.spec = spec
+
+def find_workload(name):
+    tests, oneoffs = utils.get_tests(FRAG_TEST_DIR)
+    for t in tests + oneoffs:
+        fio_file = os.path.basename(t.command)
+        if name in (t.name, t.__class__.__name__, fio_file.removesuffix('.fio')):
+            return t
+    raise ValueError(f"no aging workload '{name}' in {FRAG_TEST_DIR}")
+
+def image_key(cache, config, section, profile, workload):
+    with open(workload.command) as f:
+        job = f.read()
+    device = config.get(section, 'device')
+    return cache.key(config.get(section, 'mkfs'), config.get(section, 'mount'),
+                     imagecache.device_size(device), 'aged', profile.target,
+                     profile.rounds, job)
+
+def age(config, section, profile, workload, frag_dir, results_dir):
+    device = config.get(section, 'device')
+    directory = config.get('main', 'directory')
+    utils.run_command(f"{config.get(section, 'mkfs')} {device}")
+    with utils.Mount(config.get(section, 'mount'), device, directory):
+        for i in range(profile.rounds):
+            try:
+                utils.run_command(f"fio --directory {directory} {workload.command}")
+            except Exception as e:
+                print(f"\tAging workload failed, stopping: {e}")
+                break
+            frag = utils.measure_fragmentation(config, frag_dir, results_dir,
+                                               f"aging-{section}")
+            if not frag:
+                print("\tCan't measure fragmentation, stopping aging")
+                break
+            p50 = frag.get('frag_pct_p50', 0)
+            print(f"\tAging round {i + 1}: frag_pct_p50 {p50:.2f}")
+            if p50 >= profile.target:
+                break
+        else:
+            print(f"\tDidn't reach frag_pct_p50 {profile.target} in "
+                  f"{profile.rounds} rounds, using it as is")
+
+def aged_image(config, section, frag_dir, results_dir):
+    """The image cache key of the section's aged fs, aging it the first time"""
+    profile = Profile(config.get(section, 'age'))
+    cache = imagecache.ImageCache(config)
+    if not cache.enabled():
+        raise ValueError("age needs image_cache set in [main]")
+    if not imagecache.cacheable(config, section):
+        raise ValueError(f"can't age multi device section '{section}'")
+    workload = find_workload(profile.workload)
+    key = image_key(cache, config, section, profile, workload)
+    if not cache.has(key):
+        print(f"Aging {section} with {profile.spec}")
+        age(config, section, profile, workload, frag_dir, results_dir)
+        cache.save(config.get(section, 'device'), key)
+    return key
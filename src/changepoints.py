@@ -0,0 +1,208 @@
+import numpy
+import ResultData
+import abstats
+import utils
+
+# Finding where a continuous metric series shifted, and which kernel did it.
+#
+# For every (test, config, source, job, metric) series we keep the points since
+# its last change point in a ChangePointState row.  New runs are appended to
+# that segment and we look for the single best split of it, the one that
+# leaves the least variance on either side.  If Welch's t-test between the
+# points before and after it holds up after correcting for the number of
+# splits tried, and both sides have enough points to trust it, the split is
+# recorded as a change point with the kernels on either side of it and the
+# segment restarts from there.  The segment is capped, so the work per new run
+# doesn't grow with the history, and we never rescan old runs.
+#
+# Runs are marked once they've been fed through rather than going by the
+# highest run id seen, as workers can commit a run's metrics after a newer
+# run's.  A run without any metrics yet is picked up the next time around.
+# Points go into the segment in run time order, so a late run is slotted in
+# where it ran and the segment is tested again.  One older than the whole
+# segment belongs to a segment that's already closed, and is left out.
+
+# Points needed on either side of a split, so a change is only reported once
+# a few runs have confirmed it.  The last run by itself is what
+# utils.check_regression() is for.
+MIN_SEGMENT = 5
+# The most points kept per series when nothing has changed
+MAX_SEGMENT = 100
+# How unlikely the best split has to be to be a real change, after
+# correcting for the number of splits looked at
+ALPHA = 0.001
+T_MIN = 3.29
+# Ignore shifts smaller than this many % of the mean, quiet metrics can have
+# tiny but real shifts nobody cares about
+MIN_SHIFT_PCT = 2.0
+# Runs per query when catching up
+BATCH_RUNS = 500
+
+def pack_values(a):
+    return numpy.asarray(a, dtype='<f8').tobytes()
+
+def unpack_values(b):
+    if not b:
+        return numpy.array([], dtype=numpy.float64)
+    return numpy.frombuffer(b, dtype='<f8').copy()
+
+def unpack_ids(b):
+    if not b:
+        return numpy.array([], dtype=numpy.int64)
+    return ResultData.unpack_array(b, 1).reshape(-1).copy()
+
+def time_us(t):
+    return int(numpy.datetime64(t, 'us').astype(numpy.int64))
+
+def segment_times(session, state, ids):
+    """The run times of the segment, looked up if the state predates them"""
+    if state.times is not None or not len(ids):
+        return unpack_ids(state.times)
+    R = ResultData.Run
+    times = dict(session.query(R.id, R.time).
+                 filter(R.id.in_([int(i) for i in ids])))
+    return numpy.array([time_us(times[int(i)]) for i in ids],
+                       dtype=numpy.int64)
+
+def find_change(values):
+    """Index of the first point after the best split, or None"""
+    n = len(values)
+    if n < 2 * MIN_SEGMENT:
+        return None
+    cs = numpy.cumsum(values)
+    cs2 = numpy.cumsum(values * values)
+    # Look at every split to find where the change is, but only believe it
+    # once there are enough points after it.  Otherwise the first split that
+    # clears the threshold takes a few of the old points along with the new.
+    k = numpy.arange(MIN_SEGMENT, n)
+    nl = k
+    nr = n - k
+    left = cs[k - 1] / nl
+    right = (cs[-1] - cs[k - 1]) / nr
+    ss_left = numpy.maximum(cs2[k - 1] - nl * left * left, 0)
+    ss_right = numpy.maximum((cs2[-1] - cs2[k - 1]) - nr * right * right, 0)
+    # The change is where splitting explains the most of the variance
+    best = int(numpy.argmin(ss_left + ss_right))
+    if nr[best] < MIN_SEGMENT:
+        return None
+    # Then test it with Welch's t, a pooled variance lets a noisier run of
+    # points after a quiet one look like a shift in the mean.
+    if left[best] == right[best]:
+        return None
+    sl = ss_left[best] / (nl[best] - 1) / nl[best]
+    sr = ss_right[best] / (nr[best] - 1) / nr[best]
+    if sl + sr > 0:
+        t = abs(right[best] - left[best]) / numpy.sqrt(sl + sr)
+        # Nothing under this is ever significant, and it saves working out
+        # the p-value for almost every point
+        if t < T_MIN:
+            return None
+        df = (sl + sr) ** 2 / (sl * sl / (nl[best] - 1) +
+                               sr * sr / (nr[best] - 1))
+        p = abstats.t_pvalue(numpy.array([t]), numpy.array([df]))[0]
+        # Every split was a test, so correct for how many there were
+        if p * len(k) > ALPHA:
+            return None
+    if abs(utils.pct_diff(left[best], right[best])) < MIN_SHIFT_PCT:
+        return None
+    return int(k[best])
+
+def series_key(row):
+    return (row.name, row.config, row.source, row.job, row.metric)
+
+def record_change(session, state, ids, values, k):
+    before = session.get(ResultData.Run, int(ids[k - 1]))
+    after = session.get(ResultData.Run, int(ids[k]))
+    before_mean = float(values[:k].mean())
+    after_mean = float(values[k:].mean())
+    higher_better = utils.metric_direction(state.metric) == utils.HIGHER_IS_BETTER
+    session.add(ResultData.ChangePoint(
+        run_id=int(ids[k]), name=state.name, config=state.config,
+        source=state.source, job=state.job, metric=state.metric,
+        before_kernel=before.kernel if before else None,
+        after_kernel=after.kernel if after else None,
+        before_mean=before_mean, after_mean=after_mean,
+        regression=(after_mean > before_mean) != higher_better))
+
+def add_points(session, state, points):
+    """Add (run id, time in us, value) points, in time order"""
+    ids = unpack_ids(state.run_ids)
+    values = unpack_values(state.values)
+    times = segment_times(session, state, ids)
+    found = 0
+    for (run_id, t, value) in points:
+        pos = int(numpy.searchsorted(times, t, side='right'))
+        if pos == 0 and len(times):
+            continue
+        ids = numpy.insert(ids, pos, run_id)
+        values = numpy.insert(values, pos, value)
+        times = numpy.insert(times, pos, t)
+        k = find_change(values)
+        while k is not None:
+            record_change(session, state, ids, values, k)
+            found += 1
+            ids = ids[k:]
+            values = values[k:]
+            times = times[k:]
+            k = find_change(values)
+        if len(values) > MAX_SEGMENT:
+            ids = ids[-MAX_SEGMENT:]
+            values = values[-MAX_SEGMENT:]
+            times = times[-MAX_SEGMENT:]
+    state.run_ids = ResultData.pack_array(ids)
+    state.values = pack_values(values)
+    state.times = ResultData.pack_array(times)
+    state.last_run_id = int(ids[-1]) if len(ids) else state.last_run_id
+    return found
+
+def update(session, purpose="continuous"):
+    """Feed every run we haven't seen yet through the detector
+
+    Returns the number of new change points, caller commits.
+    """
+    S = ResultData.ChangePointState
+    M = ResultData.Metric
+    R = ResultData.Run
+    ids = [i for (i,) in session.query(R.id).
+           filter(R.purpose == purpose).
+           filter(R.changepoints_done.isnot(True)).
+           filter(R.metrics_recorded.is_(True)).
+           order_by(R.id)]
+    if not ids:
+        return 0
+    states = {series_key(s): s for s in session.query(S)}
+    found = 0
+    for i in range(0, len(ids), BATCH_RUNS):
+        batch = ids[i:i + BATCH_RUNS]
+        new = {}
+        q = session.query(M.run_id, R.time, R.name, R.config, M.source,
+                          M.job, M.metric, M.value).\
+            join(R, R.id == M.run_id).\
+            filter(M.run_id.in_(batch)).\
+            order_by(R.time, R.id, M.id)
+        for row in q:
+            new.setdefault(series_key(row), []).append(
+                (row.run_id, time_us(row.time), row.value))
+        for key, points in new.items():
+            state = states.get(key)
+            if state is None:
+                (name, config, source, job, metric) = key
+                state = S(name=name, config=config, source=source, job=job,
+                          metric=metric, last_run_id=0)
+                session.add(state)
+                states[key] = state
+            found += add_points(session, state, points)
+        session.query(R).filter(R.id.in_(batch)).\
+            update({R.changepoints_done: True}, synchronize_session=False)
+        session.flush()
+    return found
+
+def get_changes(session, name, config=None, limit=None):
+    C = ResultData.ChangePoint
+    q = session.query(C).filter(C.name == name)
+    if config is not None:
+        q = q.filter(C.config == config)
+    q = q.order_by(C.run_id.desc(), C.metric)
+    if limit is not None:
+        q = q.limit(limit)
+    return q.all()
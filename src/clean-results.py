@@ -3,6 +3,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import argparse
 import sys
+import utils
+import rollup
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--labels", nargs='*', type=str, default=[],
@@ -17,52 +19,31 @@ if not args.labels and not args.config and not args.test:
     print("Must specify either labels or configs to delete from")
     sys.exit(1)
 
-engine = create_engine('sqlite:///fsperf-results.db')
+engine = create_engine(utils.db_url())
 Session = sessionmaker()
 Session.configure(bind=engine)
 session = Session()
 
 for p in args.labels:
-    results = session.query(Run).\
-            outerjoin(FioResult).\
-            outerjoin(DbenchResult).\
-            outerjoin(TimeResult).\
-            outerjoin(Fragmentation).\
-            outerjoin(LatencyTrace).\
-            outerjoin(IOStats).\
-            outerjoin(BtrfsCommitStats).\
-            outerjoin(MountTiming).\
-            filter(Run.purpose == p).all()
+    results = utils.query_runs(session, purpose=p).all()
+    keys = rollup.run_keys(results)
     for r in results:
         session.delete(r)
+    rollup.rebuild_days(session, keys)
     session.commit()
 
 if args.test is not None:
-    results = session.query(Run).\
-            outerjoin(FioResult).\
-            outerjoin(DbenchResult).\
-            outerjoin(TimeResult).\
-            outerjoin(Fragmentation).\
-            outerjoin(LatencyTrace).\
-            outerjoin(IOStats).\
-            outerjoin(BtrfsCommitStats).\
-            outerjoin(MountTiming).\
-            filter(Run.name == args.test).all()
+    results = utils.query_runs(session, name=args.test).all()
+    keys = rollup.run_keys(results)
     for r in results:
         session.delete(r)
+    rollup.rebuild_days(session, keys)
     session.commit()
 
 if args.config is not None:
-    results = session.query(Run).\
-            outerjoin(FioResult).\
-            outerjoin(DbenchResult).\
-            outerjoin(TimeResult).\
-            outerjoin(Fragmentation).\
-            outerjoin(LatencyTrace).\
-            outerjoin(IOStats).\
-            outerjoin(BtrfsCommitStats).\
-            outerjoin(MountTiming).\
-            filter(Run.config == args.config).all()
+    results = utils.query_runs(session, config=args.config).all()
+    keys = rollup.run_keys(results)
     for r in results:
         session.delete(r)
+    rollup.rebuild_days(session, keys)
     session.commit()
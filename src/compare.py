@@ -1,4 +1,5 @@
 import ResultData
+import abstats
 
 import argparse
 import configparser
@@ -7,19 +8,18 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
 import utils
 
-def compare_results(session, section_A, section_B, test, purpose_A, purpose_B, age):
+def compare_results(session, section_A, section_B, test, purpose_A, purpose_B,
+                    age, method='welch'):
     results_A = utils.get_results(session, test.name, section_A, purpose_A, age)
     results_B = utils.get_results(session, test.name, section_B, purpose_B, age)
-    avg_A = utils.avg_results(results_A)
-    avg_B = utils.avg_results(results_B)
-    if not (avg_A and avg_B):
+    if not (results_A and results_B):
         return
-    print(f"{test.name} results")
-    utils.print_comparison_table(avg_A, avg_B)
+    print(f"{test.name} results ({len(results_A)} vs {len(results_B)} runs)")
+    utils.print_comparison_table(abstats.compare(results_A, results_B, method))
     print("")
 
 if __name__ == "__main__":
-    engine = create_engine('sqlite:///fsperf-results.db')
+    engine = create_engine(utils.db_url())
     ResultData.Base.metadata.create_all(engine)
     Session = sessionmaker()
     Session.configure(bind=engine)
@@ -29,6 +29,8 @@ if __name__ == "__main__":
     parser.add_argument('A', type=str, help='purpose A for a comparison')
     parser.add_argument('B', type=str, help='purpose B for a comparison')
     parser.add_argument('-F', '--fragmentation', action='store_true', help='include fragmentation tests')
+    parser.add_argument('-m', '--method', choices=abstats.METHODS, default='welch',
+                        help="welch's t-test, or mann-whitney u for heavy tailed metrics")
     
     args = parser.parse_args()
 
@@ -47,4 +49,5 @@ if __name__ == "__main__":
     for section in sections:
         print(f"{section} test results")
         for test in tests:
-            compare_results(session, section, section, test, args.A, args.B, age)
+            compare_results(session, section, section, test, args.A, args.B, age,
+                            args.method)
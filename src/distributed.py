@@ -0,0 +1,122 @@
+import datetime
+import socket
+import time
+import uuid
+import ResultData
+from sqlalchemy import update, func
+
+# Spreading a set of runs over several identical test hosts.  The coordinator
+# queues a work item for every (test, config, kernel, run index) in the shared
+# results db, and every worker claims items for the kernel it's booted into,
+# runs them and stores the run like a normal fsperf run would, so the results
+# all land in one place.  The db is the only thing the hosts share.
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+NOTRUN = "notrun"
+# The worker that claimed it doesn't have the test or has it disabled, which
+# means the hosts aren't set up the same
+MISSING = "missing"
+
+# Items claimed longer ago than this are assumed to belong to a worker that
+# died, and are handed out again.
+STALE_AFTER = datetime.timedelta(hours=6)
+
+def enqueue(session, tests, sections, oneoffs, kernel, purpose, numruns):
+    """Queue up a batch of work, returns the batch id, caller commits"""
+    batch = uuid.uuid4().hex[:12]
+    # Queue by run index first so every test gets a result before any of
+    # them gets their second.
+    for i in range(numruns):
+        work = [(t.name, s) for s in sections for t in tests]
+        work += [(t.name, "oneoff") for t in oneoffs]
+        for (test, config) in work:
+            session.add(ResultData.WorkItem(batch=batch, test=test,
+                                            config=config, kernel=kernel,
+                                            purpose=purpose, run_index=i,
+                                            state=PENDING))
+    return batch
+
+def claim(session, kernel, configs, hostname=None):
+    """Claim the next pending item we can run, or None if there aren't any
+
+    Another worker can grab the same item between us finding and claiming
+    it, so the claim only succeeds if the item is still pending.
+    """
+    if hostname is None:
+        hostname = socket.gethostname()
+    W = ResultData.WorkItem
+    while True:
+        row = session.query(W.id).\
+            filter(W.state == PENDING).\
+            filter(W.kernel == kernel).\
+            filter(W.config.in_(configs)).\
+            order_by(W.id).first()
+        if row is None:
+            return None
+        res = session.execute(update(W).
+                              where(W.id == row.id).
+                              where(W.state == PENDING).
+                              values(state=RUNNING, hostname=hostname,
+                                     claimed=datetime.datetime.utcnow()))
+        session.commit()
+        if res.rowcount == 1:
+            return session.get(W, row.id)
+
+def finish(session, item, state, run=None, error=None):
+    """Record how an item went, caller commits"""
+    item.state = state
+    item.finished = datetime.datetime.utcnow()
+    if run is not None:
+        item.run_id = run.id
+    if error is not None:
+        item.error = error
+
+def requeue_stale(session, batch):
+    W = ResultData.WorkItem
+    thresh = datetime.datetime.utcnow() - STALE_AFTER
+    res = session.execute(update(W).
+                          where(W.batch == batch).
+                          where(W.state == RUNNING).
+                          where(W.claimed < thresh).
+                          values(state=PENDING, hostname=None, claimed=None))
+    session.commit()
+    return res.rowcount
+
+def counts(session, batch):
+    W = ResultData.WorkItem
+    rows = session.query(W.state, func.count(W.id)).\
+        filter(W.batch == batch).group_by(W.state)
+    return {state: n for (state, n) in rows}
+
+def wait(session, batch, interval=10):
+    """Wait for every item in the batch to be run, printing progress"""
+    last = None
+    while True:
+        n = requeue_stale(session, batch)
+        if n:
+            print(f"Requeued {n} stale work items")
+        c = counts(session, batch)
+        if c != last:
+            print(", ".join(f"{k} {v}" for k, v in sorted(c.items())))
+            last = c
+        if not c.get(PENDING) and not c.get(RUNNING):
+            return c
+        # Don't hold a read transaction open against the workers
+        session.commit()
+        time.sleep(interval)
+
+def in_state(session, batch, state):
+    W = ResultData.WorkItem
+    return session.query(W).\
+        filter(W.batch == batch).\
+        filter(W.state == state).\
+        order_by(W.id).all()
+
+def failures(session, batch):
+    return in_state(session, batch, FAILED)
+
+def missing(session, batch):
+    return in_state(session, batch, MISSING)
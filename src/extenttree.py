@@ -0,0 +1,164 @@
+import errno
+import fcntl
+import heapq
+import os
+import struct
+
+# Reading the block groups and extents of a mounted btrfs straight out of the
+# extent tree with BTRFS_IOC_TREE_SEARCH_V2, the same walk bg-dump.btrd does
+# but without btrd.  Each ioctl fills a large buffer with as many items as fit,
+# and we pick the keys out of it in place.
+
+BTRFS_IOCTL_MAGIC = 0x94
+
+def _IOC(direction, nr, size):
+    return (direction << 30) | (size << 16) | (BTRFS_IOCTL_MAGIC << 8) | nr
+
+# struct btrfs_ioctl_search_key
+SEARCH_KEY = struct.Struct("=7Q4I4Q")
+# struct btrfs_ioctl_search_header
+SEARCH_HEADER = struct.Struct("=3Q2I")
+# struct btrfs_ioctl_search_args_v2, minus the flexible buf[]
+SEARCH_ARGS_V2 = struct.Struct(f"={SEARCH_KEY.size}sQ")
+BTRFS_IOC_TREE_SEARCH_V2 = _IOC(3, 17, SEARCH_ARGS_V2.size)
+# struct btrfs_ioctl_fs_info_args is 1k, nodesize comes after max_id,
+# num_devices and the fsid
+FS_INFO_SIZE = 1024
+FS_INFO_NODESIZE = struct.Struct("=I")
+FS_INFO_NODESIZE_OFFSET = 32
+BTRFS_IOC_FS_INFO = _IOC(2, 31, FS_INFO_SIZE)
+# struct btrfs_extent_item, we only want the flags
+EXTENT_ITEM_FLAGS = struct.Struct("=Q")
+EXTENT_ITEM_FLAGS_OFFSET = 16
+BTRFS_EXTENT_FLAG_TREE_BLOCK = 1 << 1
+
+BTRFS_EXTENT_TREE_OBJECTID = 2
+BTRFS_BLOCK_GROUP_TREE_OBJECTID = 11
+BTRFS_EXTENT_ITEM_KEY = 168
+BTRFS_METADATA_ITEM_KEY = 169
+BTRFS_BLOCK_GROUP_ITEM_KEY = 192
+
+U64_MAX = (1 << 64) - 1
+U32_MAX = (1 << 32) - 1
+# The kernel caps the buffer at 16M
+BUF_SIZE = 4 << 20
+
+def next_key(objectid, type, offset):
+    """The smallest key after this one, or None if it was the last"""
+    if offset < U64_MAX:
+        return (objectid, type, offset + 1)
+    if type < 255:
+        return (objectid, type + 1, 0)
+    if objectid < U64_MAX:
+        return (objectid + 1, 0, 0)
+    return None
+
+def search(fd, tree_id, min_key=(0, 0, 0), max_key=(U64_MAX, 255, U64_MAX),
+           buf_size=BUF_SIZE):
+    """Every item between the two keys, as (objectid, type, offset, data)
+
+    The range is on whole keys, so items of other types in between come back
+    too, filter them yourself.  data is a memoryview into the search buffer
+    and is only valid until the next item.
+    """
+    args = bytearray(SEARCH_ARGS_V2.size + buf_size)
+    view = memoryview(args)
+    key = min_key
+    while key is not None:
+        SEARCH_ARGS_V2.pack_into(args, 0, SEARCH_KEY.pack(
+            tree_id, key[0], max_key[0], key[2], max_key[2], 0, U64_MAX,
+            key[1], max_key[1], U32_MAX, 0, 0, 0, 0, 0), buf_size)
+        fcntl.ioctl(fd, BTRFS_IOC_TREE_SEARCH_V2, args, True)
+        nr_items = SEARCH_KEY.unpack_from(args, 0)[9]
+        if nr_items == 0:
+            return
+        pos = SEARCH_ARGS_V2.size
+        for _ in range(nr_items):
+            (_, objectid, offset, type, length) = \
+                SEARCH_HEADER.unpack_from(args, pos)
+            pos += SEARCH_HEADER.size
+            yield (objectid, type, offset, view[pos:pos + length])
+            pos += length
+        key = next_key(objectid, type, offset)
+        if key is not None and key > max_key:
+            return
+
+def nodesize(fd):
+    args = bytearray(FS_INFO_SIZE)
+    fcntl.ioctl(fd, BTRFS_IOC_FS_INFO, args, True)
+    return FS_INFO_NODESIZE.unpack_from(args, FS_INFO_NODESIZE_OFFSET)[0]
+
+def block_group_tree(fd):
+    """The block group items if the fs keeps them in their own tree"""
+    try:
+        return [item[:3] for item in
+                search(fd, BTRFS_BLOCK_GROUP_TREE_OBJECTID,
+                       (0, BTRFS_BLOCK_GROUP_ITEM_KEY, 0))
+                if item[1] == BTRFS_BLOCK_GROUP_ITEM_KEY]
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+
+def walk(directory):
+    """The block groups and extents of the fs mounted on directory
+
+    Yields (kind, offset, length) in the order bg-dump.btrd prints them, every
+    block group followed by its extents, with kind one of BLOCK-GROUP,
+    DATA-EXTENT or METADATA-EXTENT.
+    """
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        node = nodesize(fd)
+        items = search(fd, BTRFS_EXTENT_TREE_OBJECTID,
+                       (0, BTRFS_EXTENT_ITEM_KEY, 0),
+                       (U64_MAX, BTRFS_BLOCK_GROUP_ITEM_KEY, U64_MAX))
+        bgs = block_group_tree(fd)
+        if bgs:
+            items = heapq.merge(bgs, items, key=lambda item: item[:3])
+        # A block group's item comes after any extents at its very start, so
+        # hold on to extents past the current block group until we see the
+        # block group they belong to.
+        bg_end = None
+        pending = []
+        for item in items:
+            (objectid, type, offset) = item[:3]
+            if type == BTRFS_BLOCK_GROUP_ITEM_KEY:
+                yield ("BLOCK-GROUP", objectid, offset)
+                yield from pending
+                pending = []
+                bg_end = objectid + offset
+                continue
+            if type == BTRFS_METADATA_ITEM_KEY:
+                extent = ("METADATA-EXTENT", objectid, node)
+            elif type == BTRFS_EXTENT_ITEM_KEY:
+                (flags,) = EXTENT_ITEM_FLAGS.unpack_from(item[3],
+                                                         EXTENT_ITEM_FLAGS_OFFSET)
+                kind = "DATA-EXTENT"
+                if flags & BTRFS_EXTENT_FLAG_TREE_BLOCK:
+                    kind = "METADATA-EXTENT"
+                extent = (kind, objectid, offset)
+            else:
+                continue
+            if bg_end is not None and objectid < bg_end:
+                yield extent
+            else:
+                pending.append(extent)
+    finally:
+        os.close(fd)
+
+class Dump:
+    """walk() as bg-dump.btrd's text output, in a file object to read() from"""
+    def __init__(self, directory):
+        self.items = walk(directory)
+
+    def read(self, size=-1):
+        lines = []
+        n = 0
+        for (kind, offset, length) in self.items:
+            line = f"INS {kind} {offset} {length}\n".encode()
+            lines.append(line)
+            n += len(line)
+            if size >= 0 and n >= size:
+                break
+        return b"".join(lines)
@@ -0,0 +1,87 @@
+import abc
+import inspect
+import threading
+import utils
+
+# Setup that several tests can share.  A test with a fixture gets it built on
+# a fresh fs in place of its own prefill, and then only reads it, so the next
+# test with the same fixture can run on the same fs without another mkfs and
+# rebuild.  The runner puts tests with the same fixture next to each other,
+# and the fs is mounted read only (after dropping caches) for every one of
+# them so nothing a test does can leak into the next one's numbers.
+
+# device -> key of the fixture that's built on it, see PerfTest.test_context.
+# Anything else that puts a new fs on the device has to clear it.  With -j
+# every group's thread gets at this, so only go through the functions below.
+live = {}
+live_lock = threading.Lock()
+
+def is_live(device, key):
+    with live_lock:
+        return live.get(device) == key
+
+def set_live(device, key):
+    with live_lock:
+        live[device] = key
+
+def forget(device):
+    with live_lock:
+        live.pop(device, None)
+
+class Fixture(abc.ABC):
+    name = ""
+
+    @abc.abstractmethod
+    def build(self, config, section):
+        """Lay out the fixture on the fs mounted at [main] directory
+
+        The fs is freshly made and mounted read-write.  It's remounted read
+        only once this returns and is never written to again, so everything
+        the tests read has to be there by then.
+        """
+
+    # Anything that changes what build() makes needs to change this
+    def fingerprint(self):
+        return inspect.getsource(type(self))
+
+class FioLayout(Fixture):
+    """Files laid out by fio, for fio tests that read them back
+
+    Tests using this need the same --size/--nrfiles/--numjobs as the layout,
+    and fio_args() on their command line so they look for the files under the
+    fixture's name rather than their own job name.
+    """
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+
+    def fio_args(self):
+        return f" --filename_format={self.name}.$jobnum.$filenum "
+
+    def build(self, config, section):
+        directory = config.get('main', 'directory')
+        utils.run_command(f"fio --create_only=1 --directory {directory} "
+                          f"--name {self.name}{self.fio_args()}{self.command}")
+
+    def fingerprint(self):
+        return self.name + self.command
+
+# 16 jobs x 16 files x 64m, 16g in all
+FIO_16X1G = FioLayout("fio-16x1g", "--size=1g --nrfiles=16 --numjobs=16")
+
+def ro_mount(command):
+    return command + " -o ro"
+
+def order(tests):
+    """Move tests with the same fixture next to the first one that has it"""
+    ret = []
+    for t in tests:
+        if t in ret:
+            continue
+        ret.append(t)
+        if t.fixture is None:
+            continue
+        ret.extend(o for o in tests
+                   if o is not t and o.fixture is not None and
+                   o.fixture.name == t.fixture.name)
+    return ret
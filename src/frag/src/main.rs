@@ -9,6 +9,9 @@ use std::collections::Bound::{Included, Unbounded};
 use std::error;
 use std::fmt;
 use std::fs;
+use std::io::{self, BufRead, BufReader};
+use std::sync::mpsc::{sync_channel, SyncSender};
+use std::thread;
 use statrs::statistics::Data;
 use statrs::statistics::Max;
 use statrs::statistics::Min;
@@ -141,7 +144,8 @@ struct BlockGroup {
     len: u64,
     extents: BTreeMap<u64, u64>,
     extent_types: HashSet<ExtentType>,
-    img: RgbImage,
+    // only drawn when we're going to save images, it's 768K per bg
+    img: Option<RgbImage>,
     next_extent_color: Rgb<u8>,
     dump: bool,
     dump_count: usize,
@@ -193,14 +197,19 @@ fn draw_extent<P, C>(
 }
 
 impl BlockGroup {
-    fn new(offset: u64, len: u64, dump: bool) -> Self {
+    fn new(offset: u64, len: u64, dump: bool, images: bool) -> Self {
         let dim = bg_dim(len);
+        let img = if images || dump {
+            Some(ImageBuffer::from_pixel(dim, dim, WHITE_PIXEL))
+        } else {
+            None
+        };
         BlockGroup {
             offset: offset,
             len: len,
             extent_types: HashSet::new(),
             extents: BTreeMap::new(),
-            img: ImageBuffer::from_pixel(dim, dim, WHITE_PIXEL),
+            img: img,
             next_extent_color: RED_PIXEL,
             dump: dump,
             dump_count: 0,
@@ -269,7 +278,9 @@ impl BlockGroup {
 
     fn draw_extent(&mut self, extent_offset: u64, len: u64, pixel: Rgb<u8>) {
         let dim = bg_dim(self.len);
-        draw_extent(&mut self.img, self.offset, extent_offset, len, dim, pixel)
+        if let Some(img) = &mut self.img {
+            draw_extent(img, self.offset, extent_offset, len, dim, pixel)
+        }
     }
 
     fn name(&self) -> String {
@@ -286,9 +297,13 @@ impl BlockGroup {
         if d.contains("Empty") {
             return Ok(());
         }
+        let img = match &self.img {
+            Some(img) => img,
+            None => return Ok(()),
+        };
         let _ = fs::create_dir_all(&d)?;
         let path = format!("{}/{}.png", d, f);
-        Ok(self.img.save(path)?)
+        Ok(img.save(path)?)
     }
 
     fn dump_frag(&self) -> BoxResult<()> {
@@ -308,10 +323,141 @@ impl BlockGroup {
     }
 }
 
+// What dump_stats() reports, added up one block group at a time so that we
+// don't have to keep them all around for it
+#[derive(Debug, Default)]
+struct FragSummary {
+    bg_count: usize,
+    frag_pcts: Vec<f64>,
+}
+
+impl FragSummary {
+    fn add(&mut self, bg: &BlockGroup) -> BoxResult<()> {
+        self.bg_count = self.bg_count + 1;
+        if !bg.name().contains("Data") {
+            return Ok(());
+        }
+        let frag = bg.fragmentation()?;
+        if frag.percentage() == 0.0 {
+            return Ok(());
+        }
+        self.frag_pcts.push(frag.percentage());
+        Ok(())
+    }
+
+    // The percentiles are taken over every block group's percentage at the
+    // end, so the halves can just be put together
+    fn merge(&mut self, other: FragSummary) {
+        self.bg_count = self.bg_count + other.bg_count;
+        self.frag_pcts.extend(other.frag_pcts);
+    }
+}
+
+fn nr_jobs(jobs: usize) -> usize {
+    if jobs > 0 {
+        return jobs;
+    }
+    match thread::available_parallelism() {
+        Ok(n) => n.get(),
+        Err(_) => 1,
+    }
+}
+
+// Summarize a set of block groups, split up between jobs threads
+fn summarize(bgs: &BTreeMap<u64, BlockGroup>, jobs: usize) -> BoxResult<FragSummary> {
+    let bgs: Vec<&BlockGroup> = bgs.values().collect();
+    let mut summary = FragSummary::default();
+    if bgs.is_empty() {
+        return Ok(summary);
+    }
+    let per_job = (bgs.len() + jobs - 1) / jobs;
+    let parts: Vec<Result<FragSummary, String>> = thread::scope(|s| {
+        let handles: Vec<_> = bgs
+            .chunks(per_job)
+            .map(|chunk| {
+                s.spawn(move || -> Result<FragSummary, String> {
+                    let mut part = FragSummary::default();
+                    for bg in chunk {
+                        part.add(bg).map_err(|e| e.to_string())?;
+                    }
+                    Ok(part)
+                })
+            })
+            .collect();
+        handles
+            .into_iter()
+            .map(|h| h.join().unwrap_or_else(|_| Err(String::from("summary thread panicked"))))
+            .collect()
+    });
+    for part in parts {
+        summary.merge(part?);
+    }
+    Ok(summary)
+}
+
+// Block groups retired while folding, handed out round robin to threads that
+// each keep their own FragSummary, so parsing the dump and working out the
+// fragmentation of the block groups already read happen at the same time
+#[derive(Debug)]
+struct Workers {
+    queues: Vec<SyncSender<BlockGroup>>,
+    handles: Vec<thread::JoinHandle<Result<FragSummary, String>>>,
+    next: usize,
+}
+
+// Block groups queued up per thread before the reader waits for it
+const WORKER_QUEUE_DEPTH: usize = 64;
+
+impl Workers {
+    fn new(jobs: usize) -> Self {
+        let mut queues = Vec::new();
+        let mut handles = Vec::new();
+        for _ in 0..jobs {
+            let (tx, rx) = sync_channel::<BlockGroup>(WORKER_QUEUE_DEPTH);
+            queues.push(tx);
+            handles.push(thread::spawn(move || -> Result<FragSummary, String> {
+                let mut summary = FragSummary::default();
+                for bg in rx {
+                    summary.add(&bg).map_err(|e| e.to_string())?;
+                }
+                Ok(summary)
+            }));
+        }
+        Workers { queues: queues, handles: handles, next: 0 }
+    }
+
+    fn send(&mut self, bg: BlockGroup) {
+        // If the thread has already stopped, its error comes out of finish()
+        let _ = self.queues[self.next].send(bg);
+        self.next = (self.next + 1) % self.queues.len();
+    }
+
+    fn finish(self) -> BoxResult<FragSummary> {
+        drop(self.queues);
+        let mut summary = FragSummary::default();
+        for h in self.handles {
+            match h.join() {
+                Ok(part) => summary.merge(part?),
+                Err(_) => Err(String::from("summary thread panicked"))?,
+            }
+        }
+        Ok(summary)
+    }
+}
+
 #[derive(Debug)]
 struct SpaceInfo {
     block_groups: BTreeMap<u64, BlockGroup>,
     dump: bool,
+    // retire each block group as soon as the next one starts, see main()
+    fold: bool,
+    // file name to save block group images as
+    images: Option<String>,
+    raw: bool,
+    summary: FragSummary,
+    // threads to work out the stats with
+    jobs: usize,
+    workers: Option<Workers>,
 }
 
 impl SpaceInfo {
@@ -319,11 +465,18 @@ impl SpaceInfo {
         SpaceInfo {
             block_groups: BTreeMap::new(),
             dump: false,
+            fold: false,
+            images: None,
+            raw: false,
+            summary: FragSummary::default(),
+            jobs: 1,
+            workers: None,
         }
     }
     fn ins_block_group(&mut self, offset: u64, len: u64) {
+        let images = self.images.is_some();
         self.block_groups
-            .insert(offset, BlockGroup::new(offset, len, self.dump));
+            .insert(offset, BlockGroup::new(offset, len, self.dump, images));
     }
     fn del_block_group(&mut self, offset: u64) {
         self.block_groups.remove(&offset);
@@ -352,6 +505,9 @@ impl SpaceInfo {
         match alloc_change {
             AllocChange::Insert(AllocId { alloc_type, offset }, len) => match alloc_type {
                 AllocType::BlockGroup => {
+                    if self.fold {
+                        self.retire_all()?;
+                    }
                     self.ins_block_group(offset, len);
                 }
                 AllocType::Extent(extent_type) => {
@@ -370,84 +526,131 @@ impl SpaceInfo {
         Ok(())
     }
 
-    fn dump_imgs(&self, name: &str) -> BoxResult<()> {
-        for (_, bg) in &self.block_groups {
+    // We're done with a block group, count it and write out whatever was
+    // asked for
+    fn retire(&mut self, bg: &BlockGroup) -> BoxResult<()> {
+        self.summary.add(bg)?;
+        if self.raw {
+            bg.dump_frag()?;
+        }
+        if let Some(name) = &self.images {
             bg.dump_img(name)?;
         }
         Ok(())
     }
 
-    fn dump_raw(&self) -> BoxResult<()> {
-        for (_, bg) in &self.block_groups {
-            bg.dump_frag()?;
+    fn retire_all(&mut self) -> BoxResult<()> {
+        let bgs = std::mem::take(&mut self.block_groups);
+        if let Some(workers) = &mut self.workers {
+            for (_, bg) in bgs {
+                workers.send(bg);
+            }
+            return Ok(());
+        }
+        // raw and images output has to come out in order
+        if self.raw || self.images.is_some() {
+            for (_, bg) in &bgs {
+                self.retire(bg)?;
+            }
+            return Ok(());
         }
+        let summary = summarize(&bgs, self.jobs)?;
+        self.summary.merge(summary);
         Ok(())
     }
 
-    fn dump_stats(&self) -> BoxResult<()> {
-        let mut pctv: Vec<f64> = Vec::new();
-        let mut total_bgs = 0;
-        for (_, bg) in &self.block_groups {
-            total_bgs = total_bgs + 1;
-            if !bg.name().contains("Data") {
-                continue;
-            }
-            let frag = bg.fragmentation()?;
-            if frag.percentage() == 0.0 {
-                continue;
-            }
-            pctv.push(frag.percentage());
+    // Retire whatever is left and wait for the workers to finish with it
+    fn finish(&mut self) -> BoxResult<()> {
+        self.retire_all()?;
+        if let Some(workers) = self.workers.take() {
+            let summary = workers.finish()?;
+            self.summary.merge(summary);
         }
-        let mut d = Data::new(pctv);
-        let mean = match d.mean() {
-            Some(m) => m,
-            None => 0.0
-        };
-        let mut min = 0.0;
-        let mut p50 = 0.0;
-        let mut p95 = 0.0;
-        let mut p99 = 0.0;
-        let mut max = 0.0;
-        if d.len() > 0 {
-            min = d.min();
-            p50 = d.median();
-            p95 = d.percentile(95);
-            p99 = d.percentile(99);
-            max = d.max();
-        }
-        let json = json!({
-            "bg_count": total_bgs,
-            "fragmented_bg_count": d.len(),
-            "frag_pct_mean": mean,
-            "frag_pct_min": min,
-            "frag_pct_p50": p50,
-            "frag_pct_p95": p95,
-            "frag_pct_p99": p99,
-            "frag_pct_max": max
-        });
-        println!("{}", json);
         Ok(())
     }
 
-    fn handle_file(&mut self, f: &str) -> BoxResult<()> {
-        let contents = fs::read_to_string(&f)?;
-        for line in contents.split("\n") {
+    // Stats for the block groups as they are right now, for a SNAPSHOT line
+    // in the middle of a stream of changes
+    fn snapshot(&self) -> BoxResult<()> {
+        print_stats(&summarize(&self.block_groups, self.jobs)?)
+    }
+
+    fn dump_stats(&self) -> BoxResult<()> {
+        print_stats(&self.summary)
+    }
+
+    // Line at a time, so the dump never has to fit in memory
+    fn handle_input<R: BufRead>(&mut self, mut input: R) -> BoxResult<()> {
+        let mut buf = String::new();
+        loop {
+            buf.clear();
+            if input.read_line(&mut buf)? == 0 {
+                break;
+            }
+            let line = buf.trim_end();
             if line.is_empty() {
                 continue;
             }
+            if line == "SNAPSHOT" {
+                self.snapshot()?;
+                continue;
+            }
             let ac = AllocChange::from_dump(line)?;
             self.handle_alloc_change(ac)?;
         }
         Ok(())
     }
+
+    fn handle_file(&mut self, f: &str) -> BoxResult<()> {
+        if f == "-" {
+            let stdin = io::stdin();
+            return self.handle_input(stdin.lock());
+        }
+        self.handle_input(BufReader::new(fs::File::open(f)?))
+    }
+}
+
+fn print_stats(summary: &FragSummary) -> BoxResult<()> {
+    let total_bgs = summary.bg_count;
+    let mut d = Data::new(summary.frag_pcts.clone());
+    let mean = match d.mean() {
+        Some(m) => m,
+        None => 0.0
+    };
+    let mut min = 0.0;
+    let mut p50 = 0.0;
+    let mut p95 = 0.0;
+    let mut p99 = 0.0;
+    let mut max = 0.0;
+    if d.len() > 0 {
+        min = d.min();
+        p50 = d.median();
+        p95 = d.percentile(95);
+        p99 = d.percentile(99);
+        max = d.max();
+    }
+    let json = json!({
+        "bg_count": total_bgs,
+        "fragmented_bg_count": d.len(),
+        "frag_pct_mean": mean,
+        "frag_pct_min": min,
+        "frag_pct_p50": p50,
+        "frag_pct_p95": p95,
+        "frag_pct_p99": p99,
+        "frag_pct_max": max
+    });
+    println!("{}", json);
+    Ok(())
 }
 
 /// Analyze and visualize btrfs block group fragmentation
 #[derive(Parser, Debug)]
 #[clap(author, version, about, long_about = None)]
 struct Args {
-    /// btrd frag dump file name
-    #[clap(value_parser)]
+    /// btrd frag dump file name, - to read it from stdin.  It can also be a
+    /// stream of INS/DEL changes, with a SNAPSHOT line wherever we should
+    /// print the stats as of that point.
+    #[clap(value_parser, default_value = "-")]
     file: String,
 
     /// Whether or not to dump fragmentation stats
@@ -461,21 +664,36 @@ struct Args {
     /// Whether or not to dump raw bg fragmentation data
     #[clap(short, long, value_parser, default_value_t = false)]
     raw: bool,
+
+    /// Finish each block group when the next one starts instead of keeping
+    /// them all until the end.  Only for dumps that list every block group
+    /// followed by its extents, like bg-dump.btrd's.
+    #[clap(short, long, value_parser, default_value_t = false)]
+    fold: bool,
+
+    /// Threads to work out the fragmentation with, 0 for one per cpu
+    #[clap(short, long, value_parser, default_value_t = 0)]
+    jobs: usize,
 }
 
 fn main() -> BoxResult<()> {
     let args = Args::parse();
     let mut si = SpaceInfo::new();
+    si.fold = args.fold;
+    si.raw = args.raw;
+    if args.images {
+        let name = if args.file == "-" { "stdin" } else { &args.file };
+        si.images = Some(String::from(name));
+    }
+    si.jobs = nr_jobs(args.jobs);
+    if si.fold && si.jobs > 1 && !si.raw && si.images.is_none() {
+        si.workers = Some(Workers::new(si.jobs));
+    }
     si.handle_file(&args.file)?;
+    si.finish()?;
     if args.stats {
         si.dump_stats()?;
     }
-    if args.images {
-        si.dump_imgs(&args.file)?;
-    }
-    if args.raw {
-        si.dump_raw()?;
-    }
     Ok(())
 }
 
@@ -1,4 +1,6 @@
 import argparse
+import collections
+import contextlib
 import configparser
 import os
 import sys
@@ -11,9 +13,17 @@ from sqlalchemy.orm import sessionmaker
 import datetime
 import utils
 import compare
+import rollup
+import metrics
 import platform
+import scheduler
+import distributed
+import fixtures
+import nullblk
+import threading
+import time
 
-TEST_ONLY = "TMP-TEST-ONLY"
+TEST_ONLY = rollup.TEST_ONLY
 
 def clean_testonly(session, sections, tests):
     today = datetime.date.today()
@@ -38,18 +48,187 @@ def want_run_test(run_tests, disabled_tests, t):
         return False
     return True
 
-def run_test(args, session, config, section, purpose, test):
-    for i in range(0, args.numruns):
+# Serializes db writes when config groups run in parallel
+db_lock = threading.Lock()
+
+def run_test(args, session, config, section, purpose, test,
+             results="results", group=None):
+    # With --target-ci -n is the minimum number of runs, and we keep going
+    # until the regression keys settle down or we run out of budget.
+    min_runs = args.numruns
+    max_runs = args.numruns
+    deadline = None
+    if args.target_ci:
+        min_runs = max(args.numruns, 2)
+        max_runs = max(args.max_runs, min_runs)
+        if args.max_time:
+            deadline = time.monotonic() + args.max_time * 60
+    runs = []
+    values = collections.defaultdict(list)
+    ci = None
+    for i in range(0, max_runs):
         try:
             run = ResultData.Run(kernel=platform.release(), config=section,
                                  name=test.name, purpose=purpose)
-            test.run(run, config, section, "results")
-            session.add(run)
-            session.commit()
+            start = time.monotonic()
+            test.run(run, config, section, results)
+            if group is not None:
+                run.overlapped = overlaps.overlapping(group, start,
+                                                      time.monotonic())
+            with db_lock:
+                save_run(session, run, purpose)
+            runs.append(run)
         except NotRunException as e:
+            # Nothing changes between runs that would let it run next time
             print("Not run: {}".format(e))
+            break
+        if not args.target_ci:
+            continue
+        for k,v in utils.results_to_dict(run).items():
+            if k in utils.test_regression_keys:
+                values[k].append(v)
+        if len(runs) < min_runs:
+            continue
+        ci = utils.regression_ci_pct(values)
+        if ci is None:
+            print("{} has no regression keys to settle".format(test.name))
+            break
+        print("{} run {}: regression keys within +/-{:.2f}%".format(
+              test.name, len(runs), ci))
+        if ci <= args.target_ci:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            print("{} ran out of time before reaching +/-{}%".format(
+                  test.name, args.target_ci))
+            break
+    if runs:
+        with db_lock:
+            for run in runs:
+                run.nr_runs = len(runs)
+                run.ci_pct = ci
+            session.commit()
     return 0
 
+def save_run(session, run, purpose, rollups=True):
+    session.add(run)
+    session.commit()
+    metrics.record_run(session, run)
+    session.commit()
+    if rollups and purpose != TEST_ONLY:
+        rollup.add_run(session, run)
+        session.commit()
+
+def load_tests(args):
+    tests, oneoffs = utils.get_tests("tests/")
+    if args.fragmentation:
+        frag_tests, frag_oneoffs = utils.get_tests("frag_tests/")
+        tests.extend(frag_tests)
+        oneoffs.extend(frag_oneoffs)
+    return tests, oneoffs
+
+def run_section(args, session, config, section, purpose, tests,
+                results="results", group=None):
+    with nullblk.section_device(config, section):
+        setup_device(config, section)
+        for t in fixtures.order(tests):
+            if not want_run_test(args.tests, disabled_tests, t):
+                continue
+            print("Running {} ({})".format(t.__class__.__name__, section))
+            run_test(args, session, config, section, purpose, t, results, group)
+
+def run_group(args, config, group, purpose):
+    # Every group gets its own tests, sessions and results dir, the tests
+    # keep per run state on themselves.
+    session = Session()
+    tests, _ = load_tests(args)
+    utils.mkdir_p(group.results_dir)
+    overlaps.start(group)
+    try:
+        for section in group.sections:
+            section_config = group.section_config(config, section)
+            utils.mkdir_p(section_config.get('main', 'directory'))
+            run_section(args, session, section_config, section, purpose,
+                        tests, group.results_dir, group)
+    finally:
+        overlaps.finish(group)
+        session.close()
+
+def run_worker(args, session, config, sections, tests, oneoffs):
+    kernel = platform.release()
+    by_config = {"oneoff": {t.name: t for t in oneoffs}}
+    for section in sections:
+        by_config[section] = {t.name: t for t in tests}
+    device_section = None
+    device = contextlib.ExitStack()
+    while True:
+        item = distributed.claim(session, kernel, list(by_config.keys()))
+        if item is None:
+            print("No more work queued for {}".format(kernel))
+            device.close()
+            return
+        test = by_config[item.config].get(item.test)
+        if test is None or not want_run_test([], disabled_tests, test):
+            error = "not on this host" if test is None else "disabled here"
+            distributed.finish(session, item, distributed.MISSING,
+                               error=error)
+            session.commit()
+            continue
+        if item.config != "oneoff" and item.config != device_section:
+            device.close()
+            device.enter_context(nullblk.section_device(config, item.config))
+            setup_device(config, item.config)
+            device_section = item.config
+        print("Running {} ({}) run {}".format(item.test, item.config,
+                                              item.run_index))
+        run = ResultData.Run(kernel=kernel, config=item.config,
+                             name=item.test, purpose=item.purpose)
+        try:
+            test.run(run, config, item.config, "results")
+        except NotRunException as e:
+            print("Not run: {}".format(e))
+            distributed.finish(session, item, distributed.NOTRUN, error=str(e))
+            session.commit()
+            continue
+        except Exception as e:
+            print("Failed: {}".format(e))
+            distributed.finish(session, item, distributed.FAILED, error=str(e))
+            session.commit()
+            continue
+        # The coordinator folds the runs into the rollups once they're all
+        # in, so workers never race each other updating the same rows.  If it
+        # dies first the next coordinator or generate-results-page.py does.
+        save_run(session, run, item.purpose, rollups=False)
+        distributed.finish(session, item, distributed.DONE, run=run)
+        session.commit()
+
+def run_coordinator(args, session, sections, tests, oneoffs, purpose):
+    tests = [t for t in tests if want_run_test(args.tests, disabled_tests, t)]
+    oneoffs = [t for t in oneoffs
+               if want_run_test(args.tests, disabled_tests, t)]
+    kernel = args.kernel if args.kernel else platform.release()
+    batch = distributed.enqueue(session, tests, sections, oneoffs, kernel,
+                                purpose, args.numruns)
+    session.commit()
+    print("Queued batch {} for {}, run 'fsperf --worker' on the test hosts".
+          format(batch, kernel))
+    distributed.wait(session, batch)
+    for item in distributed.failures(session, batch):
+        print("{} ({}) run {} failed on {}: {}".format(item.test, item.config,
+                                                       item.run_index,
+                                                       item.hostname,
+                                                       item.error))
+    missing = distributed.missing(session, batch)
+    if missing:
+        print("These hosts aren't set up like this one, check their tests "
+              "and disabled-tests:")
+    for item in missing:
+        print("{} ({}) run {} on {}: {}".format(item.test, item.config,
+                                                item.run_index, item.hostname,
+                                                item.error))
+    # The batch's runs, and any a coordinator before us died waiting on
+    rollup.backfill(session)
+    session.commit()
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--config', type=str,
                     help="Configuration to use to run the tests")
@@ -61,6 +240,12 @@ parser.add_argument('-F', '--fragmentation', action='store_true',
                     help="include fragmentation tests in run")
 parser.add_argument('-n', '--numruns', type=int, default=1,
                     help="Run each test N number of times")
+parser.add_argument('--target-ci', type=float,
+                    help="Repeat each test until the 95%% confidence interval of its regression keys is within this many percent of the mean, -n is the minimum number of runs")
+parser.add_argument('--max-runs', type=int, default=20,
+                    help="The most times to run a test with --target-ci")
+parser.add_argument('--max-time', type=float,
+                    help="Stop repeating a test with --target-ci after this many minutes")
 parser.add_argument('-p', '--purpose', type=str, default="continuous",
                     help="Set the specific purpose for this run, useful for A/B testing")
 parser.add_argument('-C', '--compare', type=str,
@@ -68,9 +253,25 @@ parser.add_argument('-C', '--compare', type=str,
 parser.add_argument('tests', nargs='*',
                     help="Specific test[s] to run.")
 parser.add_argument('--list', action='store_true', help="List all available tests")
+parser.add_argument('-j', '--parallel', action='store_true',
+                    help="Run configs that don't share a device at the same time")
+parser.add_argument('--coordinator', action='store_true',
+                    help="Queue the runs in the results db for workers to run, and wait for them")
+parser.add_argument('--worker', action='store_true',
+                    help="Run the work queued by a coordinator for this kernel, until there is none left")
+parser.add_argument('--kernel', type=str,
+                    help="Kernel the workers must be running, used with --coordinator")
 
 args = parser.parse_args()
 
+if args.worker and (args.coordinator or args.testonly):
+    print("--worker runs whatever the coordinator queued, it can't be used with --coordinator or -t")
+    sys.exit(1)
+
+if args.target_ci and (args.worker or args.coordinator):
+    print("--target-ci can't be used with --coordinator or --worker, the work is queued up front")
+    sys.exit(1)
+
 config = configparser.ConfigParser()
 config.read('local.cfg')
 if not config.has_section('main'):
@@ -81,7 +282,9 @@ if not config.get('main', 'directory'):
     print("Must specify 'directory' in [main]")
     sys.exit(1)
 
-setup_cpu_governor(config)
+# The coordinator doesn't run anything itself
+if not args.coordinator:
+    setup_cpu_governor(config)
 
 disabled_tests = []
 failed_tests = []
@@ -96,8 +299,8 @@ except FileNotFoundError:
 
 sections = [args.config]
 if args.config is None:
-    sections = config.sections()
-    sections.remove('main')
+    sections = [s for s in config.sections()
+                if s != 'main' and not nullblk.is_profile_section(s)]
 elif not config.has_section(args.config):
     print("No section '{}' in local.cfg".format(args.config))
     sys.exit(1)
@@ -109,7 +312,7 @@ if args.compare is not None:
         print("No section '{}' in local.cfg".format(compare_config))
         sys.exit(1)
 
-engine = create_engine('sqlite:///fsperf-results.db')
+engine = create_engine(utils.db_url())
 ResultData.Base.metadata.create_all(engine)
 Session = sessionmaker()
 Session.configure(bind=engine)
@@ -117,19 +320,7 @@ session = Session()
 
 utils.mkdir_p("results/")
 
-tests, oneoffs = utils.get_tests("tests/")
-
-# In case we changed our test directory, delete bg-dump.btrd so it can be
-# re-generated with the appropriate directory
-try:
-    os.unlink('src/frag/bg-dump.btrd')
-except FileNotFoundError:
-    pass
-
-if args.fragmentation:
-    frag_tests, frag_oneoffs = utils.get_tests("frag_tests/")
-    tests.extend(frag_tests)
-    oneoffs.extend(frag_oneoffs)
+tests, oneoffs = load_tests(args)
 
 if args.list:
     print("Normal tests")
@@ -148,19 +339,34 @@ else:
     run_purpose = args.purpose
 
 # Run the normal tests
-for section in sections:
-    setup_device(config, section)
-    for t in tests:
+overlaps = scheduler.OverlapTracker()
+if args.worker:
+    run_worker(args, session, config, sections, tests, oneoffs)
+elif args.coordinator:
+    run_coordinator(args, session, sections, tests, oneoffs, run_purpose)
+else:
+    if args.parallel:
+        groups = scheduler.group_sections(config, sections)
+        threads = []
+        for g in groups:
+            print("Group {}: {} in {}".format(g.name, ", ".join(g.sections),
+                                              g.directory))
+            threads.append(threading.Thread(target=run_group,
+                                            args=(args, config, g,
+                                                  run_purpose)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        for section in sections:
+            run_section(args, session, config, section, run_purpose, tests)
+
+    for t in oneoffs:
         if not want_run_test(args.tests, disabled_tests, t):
             continue
         print("Running {}".format(t.__class__.__name__))
-        run_test(args, session, config, section, run_purpose, t)
-
-for t in oneoffs:
-    if not want_run_test(args.tests, disabled_tests, t):
-        continue
-    print("Running {}".format(t.__class__.__name__))
-    run_test(args, session, config, "oneoff", run_purpose, t)
+        run_test(args, session, config, "oneoff", run_purpose, t)
 
 if args.testonly:
     today = datetime.date.today()
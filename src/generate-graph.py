@@ -6,21 +6,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import datetime
 import utils
+import metrics
 import numbers
 
-def get_all_results(session, purpose, test):
-    results = session.query(Run).\
-        outerjoin(FioResult).\
-        outerjoin(DbenchResult).\
-        outerjoin(TimeResult).\
-        filter(Run.name == test).\
-        filter(Run.purpose == purpose).\
-        order_by(Run.time).all()
-    ret = []
-    for r in results:
-        ret.append(utils.results_to_dict(r, include_time=True))
-    return ret
-
 def get_all_purposes(session, purposes):
     r = session.query(Run.purpose).distinct().all()
     results = []
@@ -29,20 +17,26 @@ def get_all_purposes(session, purposes):
             results.append(i[0])
     return results
 
-def get_values_for_key(results_array, key):
-    runs = []
-    values = []
-    found_nonzero = False
-    count = 0
-    for run in results_array:
-        runs.append(count)
-        count += 1
-        values.append(run[key])
-        if run[key] > 0 or run[key] < 0:
-            found_nonzero = True
-    if found_nonzero:
-        return (runs, values)
-    return (None, None)
+def get_values_for_key(session, purpose, test, key):
+    """The values of key for every run of test, split up by fio job/function
+
+    Returns {job: (run indexes, values)} for the jobs with non-zero values.
+    """
+    (run_ids, times, jobs, values) = metrics.get_series(session, key,
+                                                        name=test,
+                                                        purpose=purpose)
+    # Number the runs in the order they ran, get_series() sorts by time
+    # but run ids needn't follow it
+    _, first, runs = np.unique(run_ids, return_index=True,
+                               return_inverse=True)
+    runs = np.argsort(np.argsort(first))[runs]
+    ret = {}
+    for job in np.unique(jobs):
+        mask = jobs == job
+        if not np.any(values[mask]):
+            continue
+        ret[job] = (runs[mask], values[mask])
+    return ret
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-t', '--test', type=str, required=True,
@@ -54,13 +48,16 @@ parser.add_argument('-p', '--purposes', nargs="*", type=str, default=[],
 
 args = parser.parse_args()
 
-engine = create_engine('sqlite:///fsperf-results.db')
+engine = create_engine(utils.db_url())
 Session = sessionmaker()
 Session.configure(bind=engine)
 session = Session()
 
 purposes = get_all_purposes(session, args.purposes)
 
+if metrics.backfill(session):
+    session.commit()
+
 last = utils.get_last_test(session, args.test)
 for k,v in last.items():
     if not isinstance(v, numbers.Number):
@@ -81,12 +78,9 @@ for k,v in last.items():
 
     for p in purposes:
         print(f'getting results for {p}')
-        results = get_all_results(session, p, args.test)
-        (runs, values) = get_values_for_key(results, k)
-        if runs is None:
-            continue
-
-        plt.plot(runs, values, label=p)
+        for job, (runs, values) in get_values_for_key(session, p, args.test, k).items():
+            label = f"{p} {job}" if job else p
+            plt.plot(runs, values, label=label)
 
     plt.title(f"{args.test} {k} results over time")
     plt.legend(bbox_to_anchor=(1.04, 1), borderaxespad=0)
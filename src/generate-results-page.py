@@ -2,177 +2,286 @@ from ResultData import *
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from jinja2 import Template,Environment,FileSystemLoader
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import numpy as np
 import datetime
 import utils
+import rollup
+import metrics
+import changepoints
 import numbers
 import multiprocessing
-import statistics
+import os
+import argparse
+import hashlib
+import json
 
-def get_avgs(session, config, test, days):
+def get_avgs(session, config, test, days, last):
     today = datetime.date.today()
     thresh = today - datetime.timedelta(days=days)
-    results = session.query(Run).\
-        outerjoin(FioResult).\
-        outerjoin(DbenchResult).\
-        outerjoin(TimeResult).\
-        outerjoin(Fragmentation).\
-        outerjoin(LatencyTrace).\
-        outerjoin(IOStats).\
-        outerjoin(BtrfsCommitStats).\
-        outerjoin(MountTiming).\
-        filter(Run.time >= thresh).\
-        filter(Run.config == config).\
+    # Like the runs themselves, leave the newest run out of the averages so we
+    # can check it against them, unless it's the only one.
+    nr_runs = session.query(Run).\
         filter(Run.name == test).\
+        filter(Run.config == config).\
         filter(Run.purpose == "continuous").\
-        order_by(Run.time).all()
-    newest = None
-    if len(results) > 1:
-        newest = results.pop()
-    avgs = utils.avg_results(results)
-    if newest is None:
-        return avgs
-
-    newest_dict = utils.results_to_dict(newest)
-    for k,vs in newest_dict.items():
-        if k in avgs:
-            continue
-        avgs[k] = {'mean': 0.0, 'stdev': 0}
-    return avgs
+        filter(Run.time >= thresh).count()
+    exclude = None
+    if nr_runs > 1 and last.time >= datetime.datetime.combine(thresh, datetime.time()):
+        exclude = utils.results_to_dict(last)
+    return rollup.window_avgs(session, test, config, "continuous", thresh,
+                              exclude)
 
 def get_last(session, config, test):
-    result = session.query(Run).\
-        outerjoin(FioResult).\
-        outerjoin(DbenchResult).\
-        outerjoin(TimeResult).\
-        outerjoin(Fragmentation).\
-        outerjoin(LatencyTrace).\
-        outerjoin(IOStats).\
-        outerjoin(BtrfsCommitStats).\
-        outerjoin(MountTiming).\
-        filter(Run.name == test).\
-        filter(Run.config == config).\
-        filter(Run.purpose == "continuous").\
+    return utils.query_runs(session, name=test, config=config,
+                            purpose="continuous").\
         order_by(Run.id.desc()).first()
-    if result is None:
-        return result
-    results = utils.results_to_dict(result)
+
+def last_values(run):
+    results = utils.results_to_dict(run)
     ret = {}
     for k,v in results.items():
         ret[k] = {'value': v}
     return ret
 
-def get_all_results(session, config, test):
-    results = session.query(Run).\
-        outerjoin(FioResult).\
-        outerjoin(DbenchResult).\
-        outerjoin(TimeResult).\
-        outerjoin(Fragmentation).\
-        outerjoin(LatencyTrace).\
-        outerjoin(IOStats).\
-        outerjoin(BtrfsCommitStats).\
-        outerjoin(MountTiming).\
-        filter(Run.name == test).\
-        filter(Run.config == config).\
-        filter(Run.purpose == "continuous").\
-        order_by(Run.time).all()
-    ret = []
-    for r in results:
-        ret.append(utils.results_to_dict(r, include_time=True))
-    return ret
+# Anything that changes how a graph looks needs to go in here, so that graphs
+# drawn with the old settings are seen as stale and redrawn.
+GRAPH_RENDER_SETTINGS = {
+    'version': 1,
+    'window': 'all',
+    'outlier_z': 3,
+}
+GRAPH_CACHE = "www/graphs.json"
 
-def get_values_for_key(results_array, key):
-    dates = []
-    values = []
-    found_nonzero = False
-    for run in results_array:
-        dates.append(run['time'])
-        if key not in run:
-            values.append(0)
-            continue
-        values.append(run[key])
-        if run[key] > 0 or run[key] < 0:
-            found_nonzero = True
-    if not found_nonzero:
-        return (None, None)
-
-    mean = statistics.mean(values)
-    stdev = statistics.stdev(values)
-
-    loop = True
-    while loop:
-        loop = False
-        for i in range(0, len(values)):
-            if stdev == 0:
-                break
-            zval = (values[i] - mean) / stdev
-            if zval > 3 or zval < -3:
-                del values[i]
-                del dates[i]
-                loop = True
-                break
-    if len(values) == 0:
-        return (None, None)
-    return (dates, values)
-
-def generate_graph(session, test, config):
-    last = utils.get_last_test(session, test)
-    results = get_all_results(session, config, test)
-    if len(results) == 0:
-        return
+def drop_outliers(dates, values):
+    if len(values) < 2:
+        return (dates, values)
+    stdev = values.std(ddof=1)
+    if stdev == 0:
+        return (dates, values)
+    keep = np.abs((values - values.mean()) / stdev) <= GRAPH_RENDER_SETTINGS['outlier_z']
+    return (dates[keep], values[keep])
 
+def get_graph_series(session, test, config, last):
+    """Fetch everything needed to draw the graphs for one test/config
+
+    This runs in the parent so the workers never touch the database.  Returns
+    {metric: [(job, dates, values)]} for every metric with a non-zero last
+    value.
+    """
+    all_series = metrics.get_all_series(session, test, config=config,
+                                        purpose="continuous")
+    ret = {}
     for k,v in last.items():
-        if not isinstance(v, numbers.Number):
+        # skip the 'regression' flag
+        if not isinstance(v, dict):
+            continue
+        if not isinstance(v['value'], numbers.Number):
             continue
         if "id" in k:
             continue
-        if v == 0:
+        if v['value'] == 0:
+            continue
+        if k not in all_series:
             continue
+        (dates, jobs, values) = all_series[k]
+        lines = []
+        for job in np.unique(jobs):
+            mask = jobs == job
+            if not np.any(values[mask]):
+                continue
+            (jdates, jvalues) = drop_outliers(dates[mask], values[mask])
+            if len(jvalues) == 0:
+                continue
+            lines.append((job, jdates, jvalues))
+        if lines:
+            ret[k] = lines
+    return ret
+
+# Each worker keeps one figure around and redraws it for every graph, setting
+# up a new figure is a good chunk of the cost of a small plot.
+graph_fig = None
 
-        configname = config.replace(" ", "_")
+def generate_graph(task):
+    global graph_fig
+    # Only the PNG graphs need matplotlib, --json never pays for importing it
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    (test, config, series) = task
+    if graph_fig is None:
+        graph_fig, _ = plt.subplots()
+    fig = graph_fig
+    ax = fig.axes[0]
+    configname = config.replace(" ", "_")
+    for k, lines in series.items():
         print(f'Generating graph for {test}_{configname}_{k}')
-        # Start a new figure
-        plt.figure()
-        fig, ax = plt.subplots()
+        ax.clear()
 
         # format the ticks
+        locator = mdates.AutoDateLocator(minticks=3, maxticks=7)
         ax.xaxis.set_major_locator(locator)
-        ax.xaxis.set_major_formatter(formatter)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
 
-        (dates, values) = get_values_for_key(results, k)
-        if dates is None:
-            continue
+        datemin = None
+        datemax = None
+        for (job, dates, values) in lines:
+            label = f"{config} {job}" if job else config
+            ax.plot(dates, values, label=label)
+            # figure out the range
+            if datemin is None or dates[0] < datemin:
+                datemin = dates[0]
+            if datemax is None or dates[-1] > datemax:
+                datemax = dates[-1]
 
-        # figure out the range
-        datemin = np.datetime64(dates[0], 'D')
-        datemax = np.datetime64(dates[-1], 'D') + 1
+        ax.set_xlim(np.datetime64(datemin, 'D'), np.datetime64(datemax, 'D') + 1)
+        fig.autofmt_xdate()
+        ax.set_title(f"{test} {k} {config} results over time")
+        ax.legend(bbox_to_anchor=(1.04, 1), borderaxespad=0)
+        fig.savefig(graph_filename(test, config, k), bbox_inches="tight")
 
-        plt.plot(dates, values, label=config)
+def graph_filename(test, config, metric):
+    configname = config.replace(" ", "_")
+    return f"www/{test}_{configname}_{metric}.png"
 
-        ax.set_xlim(datemin, datemax)
-        fig.autofmt_xdate()
-        plt.title(f"{test} {k} {config} results over time")
-        plt.legend(bbox_to_anchor=(1.04, 1), borderaxespad=0)
-        plt.savefig(f"www/{test}_{configname}_{k}.png", bbox_inches="tight")
-        plt.close('all')
+def graph_key(test, config, metric, last_id, lines):
+    """Hash of everything that goes into drawing a graph"""
+    h = hashlib.sha256()
+    h.update(json.dumps([test, config, metric, last_id,
+                         GRAPH_RENDER_SETTINGS]).encode())
+    for (job, dates, values) in lines:
+        h.update(str(job).encode())
+        h.update(dates.tobytes())
+        h.update(values.tobytes())
+    return h.hexdigest()
 
-def generate_graphs(session, tests, configs):
+def load_graph_cache():
+    try:
+        with open(GRAPH_CACHE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def generate_graphs(session, tests, configs, recent, last_ids, force=False):
+    cache = load_graph_cache()
+    new_cache = {}
     tasks = []
+    nr_skipped = 0
+    for t in tests:
+        for c in configs:
+            if not recent[c].get(t):
+                continue
+            series = get_graph_series(session, t, c, recent[c][t])
+            stale = {}
+            for k, lines in series.items():
+                fname = graph_filename(t, c, k)
+                key = graph_key(t, c, k, last_ids[c][t], lines)
+                new_cache[fname] = key
+                if (not force and cache.get(fname) == key and
+                    os.path.exists(fname)):
+                    nr_skipped += 1
+                    continue
+                stale[k] = lines
+            if stale:
+                tasks.append((t, c, stale))
+    print(f'{nr_skipped} graphs are up to date')
+
+    # Only ever remove graphs we drew ourselves
+    for fname in cache:
+        if fname in new_cache:
+            continue
+        print(f'Removing stale graph {fname}')
+        try:
+            os.unlink(fname)
+        except FileNotFoundError:
+            pass
+
+    # Nothing below here touches the db, don't hand our connections to the
+    # workers.
+    session.close()
+    engine.dispose()
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        for _ in pool.imap_unordered(generate_graph, tasks):
+            pass
+
+    with open(GRAPH_CACHE, 'w') as f:
+        json.dump(new_cache, f, indent=1, sort_keys=True)
+
+# The most points we send to the browser for any one line
+MAX_JSON_POINTS = 1000
+
+def lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets downsampling to n points
+
+    Keeps the first and last points, and from each bucket in between the point
+    that makes the largest triangle with the point kept from the previous
+    bucket and the average of the next bucket, which keeps the peaks and dips
+    that make a graph look the way it does.
+    """
+    if len(x) <= n or n < 3:
+        return (x, y)
+    xf = x.astype(np.float64)
+    edges = np.linspace(1, len(x) - 1, n - 1).astype(int)
+    keep = [0]
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+        else:
+            nlo, nhi = len(x) - 1, len(x)
+        avg_x = xf[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+        area = np.abs((xf[a] - avg_x) * (y[lo:hi] - y[a]) -
+                      (xf[a] - xf[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep.append(a)
+    keep.append(len(x) - 1)
+    return (x[keep], y[keep])
+
+def generate_json(session, tests, configs, recent):
+    """Write www/data/<test>.json for the interactive dashboard"""
+    utils.mkdir_p("www/data")
     for t in tests:
+        data = {}
         for c in configs:
-            tasks.append(multiprocessing.Process(target=generate_graph, args=([session, t, c])))
-    for t in tasks:
-        t.start()
-    for t in tasks:
-        t.join()
+            if not recent[c].get(t):
+                continue
+            series = get_graph_series(session, t, c, recent[c][t])
+            data[c] = {}
+            for k, lines in series.items():
+                data[c][k] = {}
+                for (job, dates, values) in lines:
+                    ms = dates.astype('datetime64[ms]').astype(np.int64)
+                    (ms, values) = lttb(ms, values, MAX_JSON_POINTS)
+                    data[c][k][str(job)] = [ms.tolist(), values.tolist()]
+        print(f'Writing data/{t}.json')
+        with open(f'www/data/{t}.json', 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+    with open('www/data/index.json', 'w') as f:
+        json.dump({'tests': tests, 'configs': configs}, f)
 
-engine = create_engine('sqlite:///fsperf-results.db')
+parser = argparse.ArgumentParser()
+parser.add_argument('-f', '--force', action='store_true',
+                    help="Redraw every graph, even if its data hasn't changed")
+parser.add_argument('--json', action='store_true',
+                    help="Write downsampled json series for dashboard.html instead of drawing graphs")
+args = parser.parse_args()
+
+engine = create_engine(utils.db_url())
 Session = sessionmaker()
 Session.configure(bind=engine)
 session = Session()
 
+if rollup.backfill(session):
+    session.commit()
+if metrics.backfill(session):
+    session.commit()
+nr_changes = changepoints.update(session)
+session.commit()
+if nr_changes:
+    print(f'Found {nr_changes} new change points')
+
 tests = []
 for tname in session.query(Run.name).distinct():
     tests.append(tname[0])
@@ -186,9 +295,11 @@ two_week_avgs = {}
 three_week_avgs = {}
 four_week_avgs = {}
 recent = {}
+last_ids = {}
 
 for c in configs:
     recent[c] = {}
+    last_ids[c] = {}
     week_avgs[c] = {}
     two_week_avgs[c] = {}
     three_week_avgs[c] = {}
@@ -202,11 +313,12 @@ for c in configs:
             print(f'no run for {t} in config {c}')
             recent[c][t] = None
             continue
-        recent[c][t] = get_last(session, c, t)
-        week_avgs[c][t] = get_avgs(session, c, t, 7)
-        two_week_avgs[c][t] = get_avgs(session, c, t, 14)
-        three_week_avgs[c][t] = get_avgs(session, c, t, 21)
-        four_week_avgs[c][t] = get_avgs(session, c, t, 28)
+        recent[c][t] = last_values(run)
+        last_ids[c][t] = run.id
+        week_avgs[c][t] = get_avgs(session, c, t, 7, run)
+        two_week_avgs[c][t] = get_avgs(session, c, t, 14, run)
+        three_week_avgs[c][t] = get_avgs(session, c, t, 21, run)
+        four_week_avgs[c][t] = get_avgs(session, c, t, 28, run)
         recent[c][t]['regression'] = False
         if (utils.check_regression(week_avgs[c][t], recent[c][t]) or
             utils.check_regression(two_week_avgs[c][t], recent[c][t]) or
@@ -218,13 +330,20 @@ env = Environment(loader=FileSystemLoader('src'))
 index_template = env.get_template('index.jinja')
 test_template = env.get_template('test.jinja')
 
+# The most change points to list per test and config
+MAX_CHANGES = 20
+
 for t in tests:
+    changes = {}
+    for c in configs:
+        changes[c] = changepoints.get_changes(session, t, c, MAX_CHANGES)
     f = open(f'www/{t}.html', 'w')
     print(f'Writing {t}.html')
     f.write(test_template.render(test=t, configs=configs,
                                  avgs=[week_avgs, two_week_avgs,
                                        three_week_avgs, four_week_avgs],
-                                 recent=recent))
+                                 recent=recent, interactive=args.json,
+                                 changes=changes))
     f.close()
 
 f = open(f'www/index.html', 'w')
@@ -232,7 +351,7 @@ print(f'Writing index.html')
 f.write(index_template.render(tests=tests, configs=configs, recent=recent))
 f.close()
 
-locator = mdates.AutoDateLocator(minticks=3, maxticks=7)
-formatter = mdates.ConciseDateFormatter(locator)
-
-generate_graphs(session, tests, configs)
+if args.json:
+    generate_json(session, tests, configs, recent)
+else:
+    generate_graphs(session, tests, configs, recent, last_ids, args.force)
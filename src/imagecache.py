@@ -0,0 +1,65 @@
+import hashlib
+import os
+import shlex
+import stat
+import utils
+
+# Saved images of prepared filesystems.  Tests that spend a long time filling
+# the fs before they measure anything (see PerfTest.prefill) only have to do
+# it once per mkfs/mount/device size, after that the image is copied back onto
+# the device instead of running mkfs and the prefill again.  Set image_cache in
+# [main] to the directory to keep the images in to turn this on.
+
+def device_size(device):
+    with open(device, 'rb') as f:
+        return f.seek(0, os.SEEK_END)
+
+def is_block_device(device):
+    return stat.S_ISBLK(os.stat(device).st_mode)
+
+def cacheable(config, section):
+    """We only save the one device, so skip multi device filesystems"""
+    if not config.has_option(section, 'mkfs'):
+        return False
+    for tok in shlex.split(config.get(section, 'mkfs')):
+        if tok.startswith('/dev/'):
+            return False
+    return True
+
+class ImageCache:
+    def __init__(self, config):
+        self.directory = config.get('main', 'image_cache', fallback=None)
+
+    def enabled(self):
+        return bool(self.directory)
+
+    def key(self, *parts):
+        h = hashlib.sha256()
+        for p in parts:
+            h.update(str(p).encode())
+            h.update(b'\0')
+        return h.hexdigest()[:16]
+
+    def path(self, key):
+        return f"{self.directory}/{key}.img"
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, device, key):
+        """Save an unmounted device, zeroed blocks are left as holes"""
+        utils.mkdir_p(self.directory)
+        tmp = self.path(key) + ".tmp"
+        utils.run_command(f"cp --sparse=always {device} {tmp}")
+        os.rename(tmp, self.path(key))
+
+    def restore(self, key, device):
+        path = self.path(key)
+        if not is_block_device(device):
+            utils.run_command(f"cp --reflink=auto --sparse=always {path} {device}")
+            return
+        # dd skips over the holes in the image, so zero the device first for
+        # them to read back as zeroes.  On devices that support it that's
+        # just a discard.
+        utils.run_command(f"blkdiscard -z {device}")
+        utils.run_command(f"dd if={path} of={device} bs=4M conv=sparse,fsync status=none")
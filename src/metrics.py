@@ -0,0 +1,105 @@
+import numpy
+import ResultData
+import utils
+from sqlalchemy import insert
+
+# The long format metric store.  Every value in a run's results gets its own
+# (run_id, source, job, metric, value) row, so pulling one metric across any
+# number of runs is a single indexed query, and fio jobs or traced functions
+# that report the same metric don't trample each other like they do in
+# utils.results_to_dict().
+
+def result_job(result):
+    job = getattr(result, 'jobname', None)
+    if job is None:
+        job = getattr(result, 'function', None)
+    return job or ""
+
+def run_rows(run):
+    rows = []
+    for rel in ResultData.RESULT_RELATIONSHIPS:
+        for r in getattr(run, rel):
+            job = result_job(r)
+            for metric, value in r.to_dict().items():
+                rows.append({'run_id': run.id, 'source': r.__tablename__,
+                             'job': job, 'metric': metric,
+                             'value': float(value)})
+    return rows
+
+def record_run(session, run):
+    """Bulk insert a committed run's metrics, caller commits"""
+    rows = run_rows(run)
+    if rows:
+        session.execute(insert(ResultData.Metric), rows)
+    # Some runs have no results at all, so the rows alone don't say whether
+    # we've been here
+    run.metrics_recorded = True
+
+def backfill(session):
+    """Fill in the metrics for runs recorded before we kept them"""
+    ids = [i for (i,) in session.query(ResultData.Run.id).
+           filter(ResultData.Run.metrics_recorded.isnot(True)).
+           order_by(ResultData.Run.id)]
+    for i in range(0, len(ids), 500):
+        runs = utils.query_runs(session).\
+            filter(ResultData.Run.id.in_(ids[i:i + 500])).all()
+        for run in runs:
+            record_run(session, run)
+    return len(ids)
+
+def get_series(session, metric, name=None, config=None, purpose=None,
+               since=None, job=None):
+    """One metric across every matching run, ordered by run time
+
+    Returns numpy arrays of (run ids, times, jobs, values).
+    """
+    M = ResultData.Metric
+    R = ResultData.Run
+    q = session.query(M.run_id, R.time, M.job, M.value).\
+        join(R, R.id == M.run_id).\
+        filter(M.metric == metric)
+    if name is not None:
+        q = q.filter(R.name == name)
+    if config is not None:
+        q = q.filter(R.config == config)
+    if purpose is not None:
+        q = q.filter(R.purpose == purpose)
+    if since is not None:
+        q = q.filter(R.time >= since)
+    if job is not None:
+        q = q.filter(M.job == job)
+    rows = q.order_by(R.time, R.id, M.id).all()
+    if not rows:
+        empty = numpy.array([])
+        return (empty, empty, empty, empty)
+    run_ids, times, jobs, values = zip(*rows)
+    return (numpy.array(run_ids), numpy.array(times, dtype='datetime64[us]'),
+            numpy.array(jobs), numpy.array(values, dtype=numpy.float64))
+
+def get_all_series(session, name, config=None, purpose=None, since=None):
+    """Every metric for the matching runs of a test in one query
+
+    Returns {metric: (times, jobs, values)} as numpy arrays ordered by run
+    time.
+    """
+    M = ResultData.Metric
+    R = ResultData.Run
+    q = session.query(M.metric, R.time, M.job, M.value).\
+        join(R, R.id == M.run_id).\
+        filter(R.name == name)
+    if config is not None:
+        q = q.filter(R.config == config)
+    if purpose is not None:
+        q = q.filter(R.purpose == purpose)
+    if since is not None:
+        q = q.filter(R.time >= since)
+    rows = {}
+    for metric, time, job, value in q.order_by(R.time, M.id):
+        rows.setdefault(metric, []).append((time, job, value))
+    ret = {}
+    for metric, mrows in rows.items():
+        times, jobs, values = zip(*mrows)
+        ret[metric] = (numpy.array(times, dtype='datetime64[us]'),
+                       numpy.array(jobs),
+                       numpy.array(values, dtype=numpy.float64))
+    return ret
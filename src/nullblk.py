@@ -1,35 +1,139 @@
+import contextlib
+import fixtures
 import os
+import re
 import utils
 
+# Emulated block devices, so that a config section can run on a null_blk
+# device instead of real hardware.  Set nullblk=profile:NAME in a section and
+# its tests run on a fresh null_blk device set up with that profile, in place
+# of its device.  NAME is one of PROFILES, or a [nullblk:NAME] section in
+# local.cfg with the null_blk configfs attributes to set, optionally on top
+# of a built-in profile named by base=.
+
+CONFIGFS = "/sys/kernel/config/nullb"
+PROFILE_SECTION_PREFIX = "nullblk:"
+
+# Everything is memory backed, a filesystem needs to read back what it wrote.
+# size is in MB, mbps of 0 is unthrottled, completion_nsec only applies with
+# irqmode=2 (timer).
+PROFILES = {
+    # No emulated latency at all, only the fs and block layer's CPU time
+    'cpu': {'queue_mode': '2', 'irqmode': '0', 'hw_queue_depth': '1024',
+            'memory_backed': '1', 'size': '16384'},
+    'fast-nvme': {'queue_mode': '2', 'irqmode': '2',
+                  'completion_nsec': '10000', 'hw_queue_depth': '1024',
+                  'memory_backed': '1', 'size': '16384'},
+    'sata-ssd': {'queue_mode': '2', 'irqmode': '2',
+                 'completion_nsec': '80000', 'hw_queue_depth': '32',
+                 'submit_queues': '1', 'mbps': '500', 'memory_backed': '1',
+                 'size': '16384'},
+    'zoned-nvme': {'queue_mode': '2', 'irqmode': '2',
+                   'completion_nsec': '10000', 'hw_queue_depth': '1024',
+                   'zoned': '1', 'zone_size': '256', 'zone_nr_conv': '8',
+                   'memory_backed': '1', 'size': '16384'},
+}
+
+def is_profile_section(section):
+    return section.startswith(PROFILE_SECTION_PREFIX)
+
+def profile(config, name):
+    """The configfs attributes for the named profile"""
+    section = PROFILE_SECTION_PREFIX + name
+    if not config.has_section(section):
+        if name not in PROFILES:
+            raise ValueError(f"no nullblk profile '{name}', add a [{section}] "
+                             f"section or use one of {', '.join(PROFILES)}")
+        return dict(PROFILES[name])
+    values = {}
+    opts = {k: v for (k, v) in config.items(section)
+            if k not in config.defaults()}
+    base = opts.pop('base', None)
+    if base is not None:
+        if base not in PROFILES:
+            raise ValueError(f"[{section}] base must be one of {', '.join(PROFILES)}")
+        values.update(PROFILES[base])
+    values.update(opts)
+    return values
+
+def section_profile(config, section):
+    if not config.has_option(section, 'nullblk'):
+        return None
+    spec = config.get(section, 'nullblk')
+    return profile(config, spec.removeprefix('profile:'))
+
+def instance_name(section):
+    """configfs and group name for a section's device"""
+    return "fsperf-" + re.sub(r'[^A-Za-z0-9_-]', '_', section)
+
 class NullBlock():
     def __del__(self):
-        if not self._started:
-            return
-        dname = f"/sys/kernel/config/nullb/{self.name}"
-        with open(f'{dname}/power', 'w') as power:
-            power.write('0')
-        os.rmdir(dname)
+        self.stop()
 
-    def __init__(self, name="nullb0"):
+    def __init__(self, name="nullb0", config_values=None):
         self._started = False
         self.name = name
-        self.config_values = {}
+        self.config_values = dict(config_values or {})
+        self.device = None
 
     def start(self):
-        if not os.path.isdir('/sys/kernel/config/nullb'):
+        if not os.path.isdir(CONFIGFS):
             utils.run_command('modprobe null_blk nr_devices=0')
 
-        if os.path.exists('/dev/nullb0'):
-            utils.run_command('rmmod null_blk')
-            utils.run_command('modprobe null_blk nr_devices=0')
-
-        dname = f"/sys/kernel/config/nullb/{self.name}"
+        dname = f"{CONFIGFS}/{self.name}"
         os.makedirs(dname)
-        for key in self.config_values:
-            with open(f"{dname}/{key}", 'w') as writer:
-                writer.write(self.config_values[key])
-        with open(f"{dname}/power", 'w') as power:
-            power.write('1')
-        with open(f'/sys/block/{self.name}/queue/scheduler', 'w') as f:
-            f.write('none')
+        try:
+            for key in self.config_values:
+                with open(f"{dname}/{key}", 'w') as writer:
+                    writer.write(self.config_values[key])
+            with open(f"{dname}/power", 'w') as power:
+                power.write('1')
+        except Exception:
+            os.rmdir(dname)
+            raise
         self._started = True
+        # The disk is named after the index the driver gave it, not us, and
+        # there may be others already
+        with open(f"{dname}/index") as f:
+            disk = f"nullb{f.read().strip()}"
+        self.device = f"/dev/{disk}"
+        # Before 6.10 zoned writes need mq-deadline to keep them in order, so
+        # leave zoned devices with the scheduler the kernel picked.
+        if self.config_values.get('zoned') == '1':
+            return
+        with open(f'/sys/block/{disk}/queue/scheduler', 'w') as f:
+            f.write('none')
+
+    def stop(self):
+        if not self._started:
+            return
+        dname = f"{CONFIGFS}/{self.name}"
+        with open(f'{dname}/power', 'w') as power:
+            power.write('0')
+        os.rmdir(dname)
+        self._started = False
+
+@contextlib.contextmanager
+def section_device(config, section):
+    """Set up the section's null_blk device, if it has one, as its device"""
+    values = section_profile(config, section)
+    if values is None:
+        yield None
+        return
+    nullb = NullBlock(instance_name(section), values)
+    nullb.start()
+    # A new device can get the name of one we tore down, along with whatever
+    # fixture fixtures.live still thinks is on it
+    fixtures.forget(nullb.device)
+    old = config.get(section, 'device', fallback=None)
+    config.set(section, 'device', nullb.device)
+    print(f"Using {nullb.device} ({config.get(section, 'nullblk')}) for {section}")
+    try:
+        yield nullb
+    finally:
+        if old is None:
+            config.remove_option(section, 'device')
+        else:
+            config.set(section, 'device', old)
+        fixtures.forget(nullb.device)
+        nullb.stop()
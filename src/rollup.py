@@ -0,0 +1,157 @@
+import datetime
+import math
+import ResultData
+import utils
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import IntegrityError
+
+# Rollups let the dashboard answer "what's the mean/stdev of this metric over
+# the last N days" from a handful of per-day rows, instead of loading every run
+# in the window and recomputing it.  Each run's results_to_dict() values are
+# folded into the row for its (test, config, purpose, metric, day).
+
+# fsperf -t runs only stay in the db long enough to compare against, they're
+# never rolled up
+TEST_ONLY = "TMP-TEST-ONLY"
+
+def run_day(run):
+    return run.time.date()
+
+def add_value(session, run, metric, value):
+    """One Welford step on the run's day row for metric
+
+    Done as a single UPDATE of the row's old values, so folds running at the
+    same time in other processes can't lose each other's updates.
+    """
+    R = ResultData.MetricRollup
+    key = dict(name=run.name, config=run.config, purpose=run.purpose,
+               metric=metric, day=run_day(run))
+    delta = value - R.mean
+    step = update(R).\
+        where(R.name == run.name).\
+        where(R.config == run.config).\
+        where(R.purpose == run.purpose).\
+        where(R.metric == metric).\
+        where(R.day == run_day(run)).\
+        values(count=R.count + 1,
+               mean=R.mean + delta / (R.count + 1),
+               m2=R.m2 + delta * delta * R.count / (R.count + 1),
+               min=case((R.min > value, value), else_=R.min),
+               max=case((R.max < value, value), else_=R.max))
+    if session.execute(step).rowcount == 1:
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(R).values(count=1, mean=value, m2=0.0,
+                                             min=value, max=value, **key))
+    except IntegrityError:
+        # Someone else made the row first
+        session.execute(step)
+
+def fold_run(session, run):
+    for metric, value in utils.results_to_dict(run).items():
+        add_value(session, run, metric, float(value))
+    run.rolled_up = True
+
+def add_run(session, run):
+    """Fold a committed run's results into the rollups, caller commits
+
+    A backfill can get to the run between it being committed and us, so it's
+    only folded in if it isn't already, and the flag stays locked until the
+    caller commits.
+    """
+    R = ResultData.Run
+    res = session.execute(update(R).
+                          where(R.id == run.id).
+                          where(R.rolled_up.isnot(True)).
+                          values(rolled_up=True))
+    if res.rowcount == 1:
+        fold_run(session, run)
+
+def rebuild_day(session, name, config, purpose, day):
+    """Recompute one day's rollups from scratch, i.e. after deleting runs"""
+    session.query(ResultData.MetricRollup).\
+        filter(ResultData.MetricRollup.name == name).\
+        filter(ResultData.MetricRollup.config == config).\
+        filter(ResultData.MetricRollup.purpose == purpose).\
+        filter(ResultData.MetricRollup.day == day).delete()
+    start = datetime.datetime.combine(day, datetime.time())
+    runs = utils.query_runs(session, name=name, config=config,
+                            purpose=purpose, since=start).\
+        filter(ResultData.Run.time < start + datetime.timedelta(days=1)).all()
+    for run in runs:
+        fold_run(session, run)
+        session.flush()
+
+def run_keys(runs):
+    """The days touched by runs, grab these before deleting them"""
+    return set((r.name, r.config, r.purpose, run_day(r)) for r in runs)
+
+def rebuild_days(session, keys):
+    for key in keys:
+        rebuild_day(session, *key)
+
+def backfill(session):
+    """Fold in every run that isn't in the rollups yet
+
+    That's runs recorded before we kept rollups, and any whose rollup never
+    happened.
+    """
+    R = ResultData.Run
+    ids = [i for (i,) in session.query(R.id).
+           filter(R.rolled_up.isnot(True)).
+           filter(R.purpose != TEST_ONLY).
+           order_by(R.id)]
+    for i in range(0, len(ids), 500):
+        runs = utils.query_runs(session).\
+            filter(ResultData.Run.id.in_(ids[i:i + 500])).\
+            order_by(ResultData.Run.id).all()
+        for run in runs:
+            add_run(session, run)
+            session.flush()
+    return len(ids)
+
+def window_avgs(session, name, config, purpose, since, exclude=None):
+    """Mean and stdev of every metric for runs on or after since
+
+    exclude is a results_to_dict() of a run in the window to leave out of the
+    averages.  The result has the same layout as utils.avg_results().
+    """
+    R = ResultData.MetricRollup
+    rows = session.query(R.metric, R.count, R.mean, R.m2).\
+        filter(R.name == name).\
+        filter(R.config == config).\
+        filter(R.purpose == purpose).\
+        filter(R.day >= since).all()
+    # Merge the days with Chan et al.'s pairwise update
+    totals = {}
+    for metric, count, mean, m2 in rows:
+        if not count:
+            continue
+        if metric not in totals:
+            totals[metric] = (count, mean, m2)
+            continue
+        (n, m, s) = totals[metric]
+        delta = mean - m
+        total = n + count
+        totals[metric] = (total, m + delta * count / total,
+                          s + m2 + delta * delta * n * count / total)
+    ret = {}
+    for metric, (count, mean, m2) in totals.items():
+        if exclude and metric in exclude:
+            # Undo the Welford step that added it
+            v = exclude[metric]
+            count -= 1
+            if count > 0:
+                old_mean = mean
+                mean = old_mean - (v - old_mean) / count
+                m2 -= (v - mean) * (v - old_mean)
+        if count <= 0:
+            ret[metric] = {'mean': 0.0, 'stdev': 0}
+            continue
+        if count == 1:
+            ret[metric] = {'mean': mean, 'stdev': 0}
+            continue
+        var = max(m2 / (count - 1), 0)
+        ret[metric] = {'mean': mean, 'stdev': math.sqrt(var)}
+    return ret
@@ -0,0 +1,115 @@
+import configparser
+import nullblk
+import os
+import shlex
+import threading
+import time
+
+# Helpers for running config sections that don't share any hardware at the
+# same time.  Sections are put in the same group if they touch the same
+# physical disk or mount the same directory, and each group runs its
+# sections one after another in its own thread.
+
+def physical_disks(dev):
+    """The whole disks backing a block device, following partitions and dm"""
+    name = os.path.basename(os.path.realpath(dev))
+    sysfs = f"/sys/class/block/{name}"
+    if not os.path.exists(sysfs):
+        return {name}
+    slaves = f"{sysfs}/slaves"
+    if os.path.isdir(slaves) and os.listdir(slaves):
+        disks = set()
+        for s in os.listdir(slaves):
+            disks |= physical_disks(f"/dev/{s}")
+        return disks
+    if os.path.exists(f"{sysfs}/partition"):
+        return {os.path.basename(os.path.dirname(os.path.realpath(sysfs)))}
+    return {name}
+
+def section_disks(config, section):
+    # null_blk devices are made per section, so they don't share anything
+    if config.has_option(section, 'nullblk'):
+        return {nullblk.instance_name(section)}
+    disks = set()
+    for opt in ['device', 'mkfs', 'mount']:
+        if not config.has_option(section, opt):
+            continue
+        for tok in shlex.split(config.get(section, opt)):
+            if tok.startswith('/dev/'):
+                disks |= physical_disks(tok)
+    return disks
+
+class Group:
+    def __init__(self, sections, disks, dirs, main_dir):
+        self.sections = sections
+        self.disks = disks
+        # the directories sections in this group asked for explicitly
+        self.dirs = dirs
+        self.name = "+".join(sorted(disks)) if disks else "nodev"
+        self.directory = f"{main_dir.rstrip('/')}-{self.name}"
+        self.results_dir = f"results/{self.name}"
+
+    def section_config(self, config, section):
+        """A copy of config with main.directory pointed at our mount point"""
+        c = configparser.ConfigParser()
+        # Raw values, c interpolates them itself and would choke on any %
+        # that was escaped as %% in local.cfg
+        c.read_dict({'DEFAULT': config.defaults()})
+        c.read_dict({s: dict(config.items(s, raw=True))
+                     for s in config.sections()})
+        c.set('main', 'directory',
+              config.get(section, 'directory', fallback=self.directory))
+        return c
+
+def group_sections(config, sections):
+    """Split sections into groups that can safely run at the same time
+
+    A section can set its own 'directory' to mount on, otherwise each group
+    gets its own directory next to the one in [main].
+    """
+    main_dir = config.get('main', 'directory')
+    groups = []
+    for section in sections:
+        disks = section_disks(config, section)
+        directory = config.get(section, 'directory', fallback=None)
+        merged = [g for g in groups
+                  if (g.disks & disks) or (not g.disks and not disks) or
+                     (directory is not None and directory in g.dirs)]
+        sects = [section]
+        dirs = {directory} if directory else set()
+        for g in merged:
+            groups.remove(g)
+            sects = g.sections + sects
+            disks |= g.disks
+            dirs |= g.dirs
+        groups.append(Group(sects, disks, dirs, main_dir))
+    # keep the config file order so runs are still easy to follow
+    groups.sort(key=lambda g: sections.index(g.sections[0]))
+    for g in groups:
+        g.sections.sort(key=sections.index)
+    return groups
+
+class OverlapTracker:
+    """Remembers when each group was busy, so runs can record who they shared
+    the machine with"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.intervals = []
+        self.active = {}
+
+    def start(self, group):
+        with self.lock:
+            self.active[group.name] = time.monotonic()
+
+    def finish(self, group):
+        with self.lock:
+            start = self.active.pop(group.name)
+            self.intervals.append((group.name, start, time.monotonic()))
+
+    def overlapping(self, group, start, end):
+        with self.lock:
+            names = set(g for (g, s, e) in self.intervals
+                        if s < end and e > start)
+            names |= set(g for (g, s) in self.active.items() if s < end)
+        names.discard(group.name)
+        return ",".join(sorted(names))
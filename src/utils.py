@@ -8,6 +8,7 @@ import texttable
 import itertools
 import datetime
 import statistics
+import math
 import subprocess
 import re
 import shlex
@@ -18,7 +19,14 @@ import numpy
 import signal
 import time
 import jinja2
+import json
+import gzip
+import contextlib
+import extenttree
 import stat
+import tempfile
+import threading
+from sqlalchemy.orm import selectinload
 
 LOWER_IS_BETTER = 0
 HIGHER_IS_BETTER = 1
@@ -48,6 +56,8 @@ METRIC_DIRECTIONS = {
 }
 
 def metric_direction(metric):
+    if "slope" in metric:
+        return HIGHER_IS_BETTER
     if "bytes" in metric:
         return HIGHER_IS_BETTER
     if "calls" in metric:
@@ -74,30 +84,42 @@ class NotRunException(Exception):
         super().__init__(m)
         self.m = m
 
+# Point FSPERF_DB at a shared database (i.e. postgresql://host/fsperf) to have
+# several hosts store their results in one place, see fsperf --coordinator.
+DEFAULT_DB = 'sqlite:///fsperf-results.db'
+
+def db_url():
+    return os.environ.get('FSPERF_DB', DEFAULT_DB)
+
+def query_runs(session, name=None, config=None, purpose=None, since=None):
+    """Query for runs and all of their results
+
+    The results are batch loaded with one query per result table for the
+    whole set of runs, rather than a query per run when they're accessed, so
+    this takes a constant number of queries no matter how many runs match.
+    The filters line up with the ix_runs_name_config_purpose_time index.
+    """
+    q = session.query(ResultData.Run).options(
+            *[selectinload(getattr(ResultData.Run, r))
+              for r in ResultData.RESULT_RELATIONSHIPS])
+    if name is not None:
+        q = q.filter(ResultData.Run.name == name)
+    if config is not None:
+        q = q.filter(ResultData.Run.config == config)
+    if purpose is not None:
+        q = q.filter(ResultData.Run.purpose == purpose)
+    if since is not None:
+        q = q.filter(ResultData.Run.time >= since)
+    return q
+
 def get_last_test(session, test):
-    result = session.query(ResultData.Run).\
-        outerjoin(ResultData.FioResult).\
-        outerjoin(ResultData.DbenchResult).\
-        outerjoin(ResultData.TimeResult).\
-        filter(ResultData.Run.name == test).\
+    result = query_runs(session, name=test).\
         order_by(ResultData.Run.id.desc()).first()
     return results_to_dict(result)
 
 def get_results(session, name, config, purpose, time):
-    return session.query(ResultData.Run).\
-                outerjoin(ResultData.FioResult).\
-                outerjoin(ResultData.DbenchResult).\
-                outerjoin(ResultData.TimeResult).\
-                outerjoin(ResultData.Fragmentation).\
-                outerjoin(ResultData.LatencyTrace).\
-                outerjoin(ResultData.IOStats).\
-                outerjoin(ResultData.BtrfsCommitStats).\
-                outerjoin(ResultData.MountTiming).\
-                filter(ResultData.Run.time >= time).\
-                filter(ResultData.Run.name == name).\
-                filter(ResultData.Run.purpose == purpose).\
-                filter(ResultData.Run.config == config).\
-                order_by(ResultData.Run.id).all()
+    return query_runs(session, name=name, config=config, purpose=purpose,
+                      since=time).order_by(ResultData.Run.id).all()
 
 # Shamelessly copied from stackoverflow
 def mkdir_p(path):
@@ -144,6 +166,11 @@ def setup_device(config, section):
         with open(f'/sys/block/{device}/queue/scheduler', 'w') as f:
             f.write(config.get(section, 'iosched'))
 
+def drop_caches():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3')
+
 def want_mkfs(test, config, section):
     return not test.skip_mkfs_and_mount and config.has_option(section, 'mkfs')
 
@@ -205,129 +232,302 @@ class Mount:
         st_mode = os.stat(self.device).st_mode
         return stat.S_ISBLK(st_mode)
 
+# Columns of the per-interval samples recorded by IOStats
+IOSTAT_SAMPLE_FIELDS = ['elapsed_ms', 'read_ios', 'read_kbytes', 'write_ios',
+                        'write_kbytes', 'in_flight', 'io_ticks_ms']
+
 class IOStats:
-    def __init__(self, dev):
+    def __init__(self, dev, interval_ms=0):
         self.dev_read_iops = 0
         self.dev_written_ios = 0
         self.dev_read_kbytes = 0
         self.dev_written_bytes = 0
         self.device = os.path.basename(os.path.realpath(dev))
+        self.interval_ms = interval_ms
+        self.samples = []
+        self.sampler = None
+        self.stop_sampling = threading.Event()
+
+    def read_stat_fields(self, f):
+        f.seek(0)
+        return [int(x) for x in f.readline().split()]
 
     def get_dev_stats(self):
         with open(f"/sys/block/{self.device}/stat") as file:
-            stats = file.readline()
-            fields = stats.split()
-            dev_stats = {"dev_read_iops": int(fields[0]),
-                         "dev_read_kbytes": int(fields[2]) * 512 / 1024,
-                         "dev_write_iops": int(fields[4]),
-                         "dev_write_kbytes": int(fields[6]) * 512 / 1024}
+            fields = self.read_stat_fields(file)
+            dev_stats = {"dev_read_iops": fields[0],
+                         "dev_read_kbytes": fields[2] * 512 / 1024,
+                         "dev_write_iops": fields[4],
+                         "dev_write_kbytes": fields[6] * 512 / 1024}
         return dev_stats
 
+    # Runs in a thread for the duration of the test.  Keep this cheap, we
+    # don't want to perturb the thing we're measuring, so just stash the raw
+    # counters and do the math once the test is over.
+    def sample(self):
+        with open(f"/sys/block/{self.device}/stat") as f:
+            interval = self.interval_ms / 1000
+            while True:
+                self.samples.append((time.monotonic_ns(),
+                                     self.read_stat_fields(f)))
+                if self.stop_sampling.wait(interval):
+                    break
+            self.samples.append((time.monotonic_ns(), self.read_stat_fields(f)))
+
     def __enter__(self):
         self.stats_start = self.get_dev_stats()
+        if self.interval_ms:
+            self.sampler = threading.Thread(target=self.sample, daemon=True)
+            self.sampler.start()
         return self
 
     def __exit__(self, et, ev, etb):
+        if self.sampler is not None:
+            self.stop_sampling.set()
+            self.sampler.join()
         self.stats_end = self.get_dev_stats()
 
+    def series(self):
+        """Per-interval deltas of the sampled counters
+
+        Returns a numpy array with one row per interval and the columns
+        described by IOSTAT_SAMPLE_FIELDS, or None if we didn't sample.
+        """
+        if len(self.samples) < 2:
+            return None
+        t0 = self.samples[0][0]
+        rows = []
+        for (pt, prev), (t, cur) in zip(self.samples, self.samples[1:]):
+            rows.append(((t - t0) // 1000000,
+                         cur[0] - prev[0],
+                         (cur[2] - prev[2]) // 2,
+                         cur[4] - prev[4],
+                         (cur[6] - prev[6]) // 2,
+                         cur[8],
+                         cur[9] - prev[9]))
+        return numpy.array(rows, dtype=numpy.int64)
+
+    def series_summary(self, series):
+        if series is None:
+            return {}
+        elapsed = numpy.diff(series[:, 0], prepend=0)
+        elapsed[elapsed == 0] = 1
+        kbytes = series[:, 2] + series[:, 4]
+        kbps = kbytes * 1000 / elapsed
+
+        # A stall is a stretch of intervals where the device had IO in flight
+        # but didn't complete any of it.
+        max_stall = 0
+        stall = 0
+        for i in range(len(series)):
+            ios = series[i, 1] + series[i, 3]
+            if ios == 0 and series[i, 5] > 0:
+                stall += elapsed[i]
+                max_stall = max(max_stall, stall)
+            else:
+                stall = 0
+        return {"dev_kbytes_per_sec_p50": float(numpy.percentile(kbps, 50)),
+                "dev_kbytes_per_sec_p99": float(numpy.percentile(kbps, 99)),
+                "dev_max_stall_ms": int(max_stall)}
+
     def results(self):
         # return stats for ios performed between enter <-> end
-        return {k: self.stats_end[k] - self.stats_start.get(k, 0) for k in self.stats_start}
+        ret = {k: self.stats_end[k] - self.stats_start.get(k, 0) for k in self.stats_start}
+        ret.update(self.series_summary(self.series()))
+        return ret
+
+# Multipliers bpftrace uses when printing hist()/lhist() bucket bounds
+HIST_SUFFIXES = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30,
+                 'T': 1 << 40, 'P': 1 << 50, 'E': 1 << 60}
+# Used when a linear trace doesn't specify its max
+LINEAR_DEFAULT_BUCKETS = 1000
+
+def parse_trace_fn(spec):
+    """Split a trace_fns entry into (function, mode, args)
+
+    Entries are either a bare function name, which traces exact delays, or
+    'fn:log2' for power of 2 buckets, or 'fn:linear:STEP[:MAX]' for STEP ns
+    wide buckets up to MAX ns.  The bucketed modes are aggregated in the
+    kernel, so the number of map entries is fixed no matter how long we run.
+    """
+    parts = spec.split(':')
+    fn = parts[0]
+    mode = parts[1] if len(parts) > 1 else "exact"
+    if mode in ("exact", "log2") and len(parts) <= 2:
+        return (fn, mode, ())
+    if mode == "linear" and len(parts) in (3, 4):
+        step = int(parts[2])
+        if len(parts) == 4:
+            maxval = int(parts[3])
+        else:
+            maxval = step * LINEAR_DEFAULT_BUCKETS
+        if step <= 0 or maxval <= step:
+            raise ValueError(f"invalid linear trace resolution '{spec}'")
+        return (fn, mode, (step, maxval))
+    raise ValueError(f"invalid trace_fns entry '{spec}'")
+
+def parse_hist_value(s):
+    m = re.match(r"(\d+)([KMGTPE]?)$", s.strip())
+    if not m:
+        return None
+    return int(m.group(1)) * HIST_SUFFIXES[m.group(2)]
+
+def parse_hist_line(l):
+    """Parse one bucket line of bpftrace hist()/lhist() output
+
+    Returns (latency, count), using the midpoint of the bucket as its
+    latency, or None if this isn't a bucket line.
+    """
+    m = re.match(r"^[\[(]([^,\])]+)(?:,\s*([^\])]+))?[\])]\s+(\d+)", l)
+    if not m:
+        return None
+    lo_str, hi_str, count_str = m.groups()
+    lo = parse_hist_value(lo_str)
+    # the (..., 0) bucket, we can't have negative delays
+    if lo is None:
+        return None
+    hi = parse_hist_value(hi_str) if hi_str else None
+    if hi is None:
+        lat = lo
+    else:
+        lat = (lo + hi) / 2
+    return (lat, int(count_str))
+
+def weighted_percentile(values, counts, pct):
+    """Percentile of a histogram of sorted values and their counts
+
+    Gives the same answer as numpy.percentile() with the default linear
+    interpolation would on the expanded list of samples, without ever
+    building that list.
+    """
+    cum = numpy.cumsum(counts)
+    rank = (cum[-1] - 1) * pct / 100
+    lo = int(numpy.floor(rank))
+    hi = int(numpy.ceil(rank))
+    lo_val = values[numpy.searchsorted(cum, lo, side='right')]
+    hi_val = values[numpy.searchsorted(cum, hi, side='right')]
+    return float(lo_val + (hi_val - lo_val) * (rank - lo))
 
 class LatencyTracing:
     def __init__(self, fns):
-        self.ps = {}
+        self.p = None
         self.latencies = {}
         self.calls = {}
-        self.fns = fns
-
-    def start_latency_trace(self, fn):
+        self.modes = {}
+        self.fns = []
+        for spec in fns:
+            fn, mode, args = parse_trace_fn(spec)
+            self.fns.append(fn)
+            self.modes[fn] = (mode, args)
+
+    def delay_aggregation(self, fn, delays):
+        mode, args = self.modes[fn]
+        if mode == "log2":
+            return f"{delays} = hist($delay);"
+        if mode == "linear":
+            step, maxval = args
+            return f"{delays} = lhist($delay, 0, {maxval}, {step});"
+        return f"{delays}[$delay]++;"
+
+    def latency_probes(self, i, fn):
+        # each function gets its own maps, traced functions may nest
+        start = f"@start_{i}"
+        agg = self.delay_aggregation(fn, f"@delays_{i}")
+        kprobe = f"kprobe:{fn} {{ {start}[tid] = nsecs; }}"
+        kretprobe = f"kretprobe:{fn} {{ if({start}[tid]) {{ $delay = nsecs - {start}[tid]; {agg} }} delete({start}[tid]); }}"
+        return f"{kprobe} {kretprobe}"
+
+    def start_latency_trace(self):
         # this sets the max size of a map in bpftrace
         # in our case, this is a bound on the number of unique delays we trace
         os.environ["BPFTRACE_MAP_KEYS_MAX"] = "65536"
-        kprobe = f"kprobe:{fn} {{ @start[tid] = nsecs; }}"
-        kretprobe = f"kretprobe:{fn} {{ if(@start[tid]) {{ $delay = nsecs - @start[tid]; @delays[$delay]++; }} delete(@start[tid]); }}"
-        end = "END { clear(@start); }"
-        self.ps[fn] = Popen(["bpftrace", "-e", f"{kprobe} {kretprobe} {end}"], text=True, stdout=PIPE, stderr=PIPE)
-
-    def collect_latency_trace(self, fn):
-        bt_p = self.ps[fn]
+        probes = [self.latency_probes(i, fn) for i, fn in enumerate(self.fns)]
+        clears = " ".join(f"clear(@start_{i});" for i in range(len(self.fns)))
+        end = f"END {{ {clears} }}"
+        prog = " ".join(probes + [end])
+        self.p = Popen(["bpftrace", "-e", prog], text=True, stdout=PIPE, stderr=PIPE)
+
+    def collect_latency_trace(self):
+        bt_p = self.p
         bt_p.send_signal(signal.SIGINT)
         # ignore errors in latency tracing; better to let the whole run still complete.
         try:
             stdout, stderr = bt_p.communicate(timeout=15)
         except subprocess.TimeoutExpired:
-            print("Couldn't interrupt {fn} bpftrace. Kill it and move on.")
+            print("Couldn't interrupt bpftrace. Kill it and move on.")
             bt_p.kill()
             return
         if bt_p.returncode:
-            print(f"{fn} bpftrace had an error {bt_p.returncode}. stderr: {stderr.strip()}")
+            print(f"bpftrace had an error {bt_p.returncode}. stderr: {stderr.strip()}")
             return
-        self.latencies[fn] = []
-        out = stdout.split('\n')
-        if len(out) == 65536:
-            raise OverflowError(f"too many unique delay values: {len(out)} while tracing {fn}. Increase BPFTRACE_MAP_KEYS_MAX above")
-        for l in out:
-            if not l:
+        for fn in self.fns:
+            self.latencies[fn] = collections.Counter()
+
+        # exact maps print as '@delays_N[lat]: count', histograms print a
+        # '@delays_N:' header followed by one line per bucket.
+        exact_re = r"@delays_(\d+)\[(\d+)\]:\s*(\d+)"
+        header_re = r"@delays_(\d+):\s*$"
+        hist_fn = None
+        for l in stdout.split('\n'):
+            m = re.match(exact_re, l)
+            if m:
+                fn = self.fns[int(m.group(1))]
+                self.latencies[fn][int(m.group(2))] += int(m.group(3))
                 continue
-            if 'Attaching' in l:
+            m = re.match(header_re, l)
+            if m:
+                hist_fn = self.fns[int(m.group(1))]
                 continue
-            lat_str, count_str = l.split(':')
-            lat_re = r"@delays\[(\d+)\]"
-            m = re.match(lat_re, lat_str)
-            if not m:
+            if hist_fn is None:
                 continue
-            lat = int(m.groups()[0])
-            count = int(count_str)
-            self.latencies[fn] += [lat] * count
+            bucket = parse_hist_line(l)
+            if bucket is None or not bucket[1]:
+                continue
+            self.latencies[hist_fn][bucket[0]] += bucket[1]
+
+        for fn in self.fns:
+            if self.modes[fn][0] == "exact" and len(self.latencies[fn]) >= 65536:
+                raise OverflowError(f"too many unique delay values: {len(self.latencies[fn])} while tracing {fn}. Increase BPFTRACE_MAP_KEYS_MAX above or trace {fn}:log2")
 
     def results(self):
         r = []
-        for fn, lats in self.latencies.items():
-            if not lats:
+        for fn, hist in self.latencies.items():
+            if not hist:
                 continue
+            lats = numpy.array(sorted(hist), dtype=numpy.float64)
+            counts = numpy.array([hist[l] for l in sorted(hist)], dtype=numpy.int64)
+            calls = int(counts.sum())
             t = {}
             t["function"] = fn
-            t["ns_mean"] = statistics.mean(lats)
-            t["ns_min"] = min(lats)
-            t["ns_p50"] = numpy.percentile(lats, 50)
-            t["ns_p95"] = numpy.percentile(lats, 95)
-            t["ns_p99"] = numpy.percentile(lats, 99)
-            t["ns_max"] = max(lats)
-            t["calls"] = len(lats)
+            t["ns_mean"] = float(numpy.dot(lats, counts) / calls)
+            t["ns_min"] = float(lats[0])
+            t["ns_p50"] = weighted_percentile(lats, counts, 50)
+            t["ns_p95"] = weighted_percentile(lats, counts, 95)
+            t["ns_p99"] = weighted_percentile(lats, counts, 99)
+            t["ns_max"] = float(lats[-1])
+            t["calls"] = calls
             r.append(t)
         return r
 
     def __enter__(self):
-        for fn in self.fns:
-            self.start_latency_trace(fn)
+        if self.fns:
+            self.start_latency_trace()
         return self
 
     def __exit__(self, et, ev, etb):
-        for fn in self.fns:
-            self.collect_latency_trace(fn)
+        if self.p is not None:
+            self.collect_latency_trace()
 
 def results_to_dict(run, include_time=False):
     ret_dict = {}
-    sub_results = list(itertools.chain(run.time_results, run.fio_results,
-                                       run.dbench_results, run.fragmentation,
-                                       run.latency_traces,
-                                       run.io_stats,
-                                       run.btrfs_commit_stats,
-                                       run.mount_timings))
+    sub_results = itertools.chain.from_iterable(
+            getattr(run, r) for r in ResultData.RESULT_RELATIONSHIPS)
     for r in sub_results:
         ret_dict.update(r.to_dict())
     if include_time:
         ret_dict['time'] = run.time
     return ret_dict
 
-def filter_outliers(vs, mean, stdev):
-    def z(v, mean, stdev):
-        if not stdev or not mean:
-            return 0
-        return (v - mean) / stdev
-    return [v for v in vs if abs(z(v, mean, stdev)) > 3]
-
 def avg_results(results):
     ret_dict = {}
     vals_dict = collections.defaultdict(list)
@@ -342,9 +542,7 @@ def avg_results(results):
             ret_dict[k]['stdev'] = 0
             continue
         mean = statistics.mean(vs)
-        stdev = statistics.stdev(vs)
-        filtered = filter_outliers(vs, mean, stdev)
-        ret_dict[k]['mean'] = statistics.mean(vs)
+        ret_dict[k]['mean'] = mean
         ret_dict[k]['stdev'] = statistics.stdev(vs)
     return ret_dict
 
@@ -360,30 +558,59 @@ def color_str(s, color):
     ENDC = '\033[0m'
     return color + s + ENDC
 
-def diff_string(a, b, better):
+def diff_string(row):
+    """The % change of an abstats.compare() row, colored if it's significant"""
     DEFAULT = '\033[99m'
     GREEN = '\033[92m'
     RED = '\033[91m'
-    sig_delta = a['stdev'] * 1.96
-    lo_thresh = a['mean'] - sig_delta
-    hi_thresh = a['mean'] + sig_delta
-    below = b['mean'] < lo_thresh
-    above = b['mean'] > hi_thresh
-    higher_better = better == HIGHER_IS_BETTER
-
-    bad = (below and higher_better) or (above and not higher_better)
-    good = (above and higher_better) or (below and not higher_better)
-    if bad:
+    if row['worse']:
         color = RED
-    elif good:
+    elif row['better']:
         color = GREEN
     else:
         color = DEFAULT
-
-    diff = pct_diff(a['mean'], b['mean'])
-    diff_str = "{:.2f}%".format(diff)
+    diff_str = "{:.2f}%".format(row['diff'])
     return color_str(diff_str, color)
 
+def ci_string(row):
+    if numpy.isnan(row['ci_lo']):
+        return ""
+    return "{:.1f}%..{:.1f}%".format(row['ci_lo'], row['ci_hi'])
+
+def stat_string(v, fmt):
+    if numpy.isnan(v):
+        return ""
+    return fmt.format(v)
+
+# Two sided 95% t values for 1 to 30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def t_critical(df):
+    if df <= len(T_95):
+        return T_95[df - 1]
+    return 1.96
+
+def ci_pct(vs):
+    """Half width of the 95% confidence interval of the mean, as a % of it"""
+    if len(vs) < 2:
+        return None
+    mean = statistics.mean(vs)
+    if mean == 0:
+        return None
+    halfwidth = t_critical(len(vs) - 1) * statistics.stdev(vs) / math.sqrt(len(vs))
+    return abs(halfwidth / mean) * 100
+
+def regression_ci_pct(vals_dict):
+    """The widest ci_pct() of the regression keys, None if there aren't any"""
+    cis = [ci_pct(vs) for k,vs in vals_dict.items()
+           if k in test_regression_keys]
+    cis = [ci for ci in cis if ci is not None]
+    if not cis:
+        return None
+    return max(cis)
+
 def check_regression(baseline, recent):
     nr_regress_keys = 0
     nr_fail = 0
@@ -414,22 +641,19 @@ def check_regression(baseline, recent):
         fail_thresh = 1
     return nr_fail >= fail_thresh
 
-def print_comparison_table(baseline, results):
-    table = texttable.Texttable(max_width=100)
+def print_comparison_table(comparison):
+    table = texttable.Texttable(max_width=120)
     table.set_precision(2)
     table.set_deco(texttable.Texttable.HEADER)
-    table.set_cols_dtype(['t', 'a', 'a', 'a', 't'])
-    table.set_cols_align(['l', 'r', 'r', 'r', 'r'])
-    table_rows = [["metric", "baseline", "current", "stdev", "diff"]]
-    for k,v in sorted(baseline.items()):
-        if k not in results:
-            continue
-        if not v['mean'] and not results[k]['mean']:
-            continue
-        better = metric_direction(k)
-        diff_str = diff_string(v, results[k], better)
-        cur = [k, v['mean'], results[k]['mean'], v['stdev'], diff_str]
-        table_rows.append(cur)
+    table.set_cols_dtype(['t', 'a', 'a', 'a', 't', 't', 't', 't'])
+    table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r', 'r', 'r'])
+    table_rows = [["metric", "baseline", "current", "stdev", "diff",
+                   "95% ci", "q", "g"]]
+    for row in comparison:
+        table_rows.append([row['metric'], row['mean_A'], row['mean_B'],
+                           row['stdev_A'], diff_string(row), ci_string(row),
+                           stat_string(row['q'], "{:.3f}"),
+                           stat_string(row['effect'], "{:.2f}")])
     table.add_rows(table_rows)
     print(table.draw())
 
@@ -521,11 +745,247 @@ def get_tests(test_dir):
                         tests.append(t)
     return tests, oneoffs
 
-def generate_bg_dump(config, frag_dir):
-    if os.path.exists(f"{frag_dir}/bg-dump.btrd"):
-        return
+def generate_bg_dump(config, frag_dir, path):
     env = jinja2.Environment(loader=jinja2.FileSystemLoader(frag_dir))
     template = env.get_template('bg-dump.jinja')
-    f = open(f'{frag_dir}/bg-dump.btrd', 'w')
+    f = open(path, 'w')
     f.write(template.render(testdir=config.get('main', 'directory')))
     f.close()
+
+def use_btrd(config):
+    return config.get('main', 'frag_collector', fallback='ioctl') == 'btrd'
+
+def copy_stream(src, dsts, bufsize=1 << 20):
+    while True:
+        buf = src.read(bufsize)
+        if not buf:
+            break
+        for dst in dsts:
+            dst.write(buf)
+
+def read_stderr(f):
+    f.seek(0)
+    return f.read().decode(errors='replace').strip()
+
+def measure_fragmentation(config, frag_dir, results_dir, name):
+    """Dump the mounted fs's block groups and summarize their fragmentation
+
+    The dump is piped straight into btrfs-frag-view, which folds up each block
+    group as it goes, so neither side ever holds the whole dump.  With
+    keep_frag_dumps set in [main] a gzipped copy of it is saved along the way.
+    The dump comes from extenttree.py, or from btrd with frag_collector=btrd.
+
+    Returns btrfs-frag-view's stats, or {} if we couldn't collect them.
+    """
+    frag_filename = f"{results_dir}/{name}.frag"
+    keep = config.getboolean('main', 'keep_frag_dumps', fallback=False)
+    view_cmd = [f"{frag_dir}/target/release/btrfs-frag-view", "--fold", "-"]
+    dump_cmd = None
+    if use_btrd(config):
+        bg_dump_script = f"{results_dir}/bg-dump.btrd"
+        generate_bg_dump(config, frag_dir, bg_dump_script)
+        dump_cmd = ["btrd", bg_dump_script]
+        print(f"  running cmd '{' '.join(dump_cmd)} | {' '.join(view_cmd)}'")
+    else:
+        print(f"  running cmd '{' '.join(view_cmd)}'")
+    collect_err = None
+    # Nothing reads their stderr until the dump is done, so it goes to files
+    # rather than pipes that would fill up and stall them
+    with open(frag_filename, 'w') as f, \
+         tempfile.TemporaryFile() as dump_errf, \
+         tempfile.TemporaryFile() as view_errf:
+        dump = None
+        try:
+            if dump_cmd is not None:
+                dump = Popen(dump_cmd, stdout=PIPE, stderr=dump_errf)
+                source = dump.stdout
+            else:
+                source = extenttree.Dump(config.get('main', 'directory'))
+            # Without a copy to keep btrd can write to btrfs-frag-view directly
+            direct = dump is not None and not keep
+            view = Popen(view_cmd, stdin=source if direct else PIPE,
+                         stdout=f, stderr=view_errf)
+        except OSError as e:
+            # i.e. no btrd, or btrfs-frag-view hasn't been built
+            if dump is not None:
+                dump.kill()
+                dump.stdout.close()
+                dump.wait()
+            print(f"failed to collect fragmentation data: {e}")
+            return {}
+        if not direct:
+            try:
+                with contextlib.ExitStack() as stack:
+                    dsts = [view.stdin]
+                    if keep:
+                        dsts.append(stack.enter_context(
+                            gzip.open(f"{results_dir}/{name}.bgs.gz", 'wb')))
+                    copy_stream(source, dsts)
+            except BrokenPipeError:
+                # btrfs-frag-view gave up, its error is below
+                pass
+            except OSError as e:
+                collect_err = e
+                view.kill()
+        if dump is not None:
+            # Only btrfs-frag-view reads the pipe now, so btrd gets EPIPE
+            # rather than hanging if it exits early
+            dump.stdout.close()
+        view.communicate()
+        view_err = read_stderr(view_errf)
+        if dump is not None:
+            dump.wait()
+            # btrd being killed by SIGPIPE just means btrfs-frag-view failed
+            if dump.returncode and dump.returncode != -signal.SIGPIPE:
+                collect_err = f"{read_stderr(dump_errf)}. (Likely, running the btrd script OOMed)"
+    if collect_err is not None:
+        print(f"failed to collect fragmentation data: {collect_err}")
+        return {}
+    if view.returncode:
+        print(f"failed to analyze fragmentation data: {view_err}.")
+        return {}
+    return json.load(open(frag_filename))
+
+# Columns of FragSampler.series(), the rest are btrfs-frag-view's stats
+FRAG_SAMPLE_FIELDS = ['elapsed_ms', 'bg_count', 'fragmented_bg_count',
+                      'frag_pct_mean', 'frag_pct_min', 'frag_pct_p50',
+                      'frag_pct_p95', 'frag_pct_p99', 'frag_pct_max']
+
+def parse_bg_dump(lines):
+    """bg-dump.btrd's output as (kind, offset, len), like extenttree.walk()"""
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 4 or parts[0] != "INS":
+            continue
+        yield (parts[1], int(parts[2]), int(parts[3]))
+
+def read_bg_dump(items):
+    """A dump as {bg offset: (bg len, {(kind, offset, len)})}"""
+    bgs = {}
+    extents = None
+    for (kind, offset, length) in items:
+        if kind == "BLOCK-GROUP":
+            extents = set()
+            bgs[offset] = (length, extents)
+        elif extents is not None:
+            extents.add((kind, offset, length))
+    return bgs
+
+def bg_dump_deltas(old, new):
+    """The INS/DEL lines that take btrfs-frag-view from one dump to the next
+
+    A block group that went away takes its extents with it, so those only
+    need the one DEL, and a new one gets all of its extents.
+    """
+    lines = []
+    for offset, (length, _) in old.items():
+        if offset not in new or new[offset][0] != length:
+            lines.append(f"DEL BLOCK-GROUP {offset}")
+    for offset, (length, extents) in new.items():
+        if offset not in old or old[offset][0] != length:
+            lines.append(f"INS BLOCK-GROUP {offset} {length}")
+            added = extents
+        else:
+            prev = old[offset][1]
+            added = extents - prev
+            # Before the INSes, an extent can come back at the same offset
+            # with a different length
+            for (kind, start, _) in sorted(prev - extents):
+                lines.append(f"DEL {kind} {start}")
+        for (kind, start, size) in sorted(added):
+            lines.append(f"INS {kind} {start} {size}")
+    return lines
+
+class FragSampler:
+    """Fragmentation over time, every interval_s seconds while a test runs
+
+    Each snapshot is a fresh dump of the extent tree, but only what changed
+    since the last one is sent on to a btrfs-frag-view that keeps running for
+    the whole test, and it prints the stats as of each snapshot.
+    """
+    def __init__(self, config, frag_dir, results_dir, interval_s=0):
+        self.config = config
+        self.frag_dir = frag_dir
+        self.results_dir = results_dir
+        self.interval_s = interval_s
+        self.samples = []
+        self.bgs = {}
+        self.view = None
+        self.sampler = None
+        self.stop_sampling = threading.Event()
+
+    def read_dump(self):
+        if not use_btrd(self.config):
+            return read_bg_dump(extenttree.walk(self.config.get('main', 'directory')))
+        dump = Popen(["btrd", self.script], stdout=PIPE, stderr=DEVNULL,
+                     text=True)
+        bgs = read_bg_dump(parse_bg_dump(dump.stdout))
+        dump.stdout.close()
+        if dump.wait():
+            raise CalledProcessError(dump.returncode, f"btrd {self.script}")
+        return bgs
+
+    def snapshot(self):
+        bgs = self.read_dump()
+        elapsed = (time.monotonic_ns() - self.start) // 1000000
+        for line in bg_dump_deltas(self.bgs, bgs):
+            self.view.stdin.write(line + "\n")
+        self.view.stdin.write("SNAPSHOT\n")
+        self.view.stdin.flush()
+        stats = json.loads(self.view.stdout.readline())
+        self.bgs = bgs
+        self.samples.append([elapsed] +
+                            [stats[k] for k in FRAG_SAMPLE_FIELDS[1:]])
+
+    def sample(self):
+        while True:
+            try:
+                self.snapshot()
+            except Exception as e:
+                print(f"failed to take fragmentation snapshot: {e}")
+                return
+            if self.stop_sampling.wait(self.interval_s):
+                break
+        try:
+            self.snapshot()
+        except Exception as e:
+            print(f"failed to take fragmentation snapshot: {e}")
+
+    def __enter__(self):
+        if not self.interval_s:
+            return self
+        if use_btrd(self.config):
+            self.script = f"{self.results_dir}/bg-dump-sampler.btrd"
+            generate_bg_dump(self.config, self.frag_dir, self.script)
+        self.view = Popen([f"{self.frag_dir}/target/release/btrfs-frag-view", "-"],
+                          stdin=PIPE, stdout=PIPE, stderr=DEVNULL, text=True)
+        self.start = time.monotonic_ns()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, et, ev, etb):
+        if self.sampler is not None:
+            self.stop_sampling.set()
+            self.sampler.join()
+        if self.view is not None:
+            try:
+                self.view.communicate()
+            except BrokenPipeError:
+                self.view.wait()
+        self.bgs = {}
+
+    def series(self):
+        """One row per snapshot with the columns in FRAG_SAMPLE_FIELDS, or
+        None if we didn't sample."""
+        if not self.samples:
+            return None
+        return numpy.array(self.samples, dtype=numpy.float64)
+
+    def results(self):
+        """The worst the fragmentation got during the test"""
+        series = self.series()
+        if series is None:
+            return {}
+        return {f"peak_{k}": float(series[:, FRAG_SAMPLE_FIELDS.index(k)].max())
+                for k in ('frag_pct_p50', 'frag_pct_p95', 'frag_pct_max')}
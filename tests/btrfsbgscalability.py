@@ -9,6 +9,7 @@ class BtrfsBgScalability(FioTest):
                "--ioengine=io_uring --iodepth=64 --bs=64k --filesize=1g "
                "--runtime=300 --time_based --numjobs=8 --thread")
     oneoff = True
+    fio_log_msec = 1000
     skip_mkfs_and_mount = True
 
     def teardown(self, config, results):
@@ -34,9 +35,9 @@ class BtrfsBgScalability(FioTest):
         mntcmd = "mount -o ssd,nodatacow"
 
         # First create the nullblk fs to load the loop device onto
-        command = f'mkfs.btrfs {mkfsopts} /dev/nullb0'
+        command = f'mkfs.btrfs {mkfsopts} {self.nullblk.device}'
         utils.run_command(command)
-        self.nullb_mnt = utils.Mount(mntcmd, '/dev/nullb0', directory)
+        self.nullb_mnt = utils.Mount(mntcmd, self.nullblk.device, directory)
 
         # Now create the loop device
         loopdir = f'{directory}/loop'
@@ -2,12 +2,14 @@ import sys
 from PerfTest import FioTest
 from utils import get_fstype,set_readpolicy,get_active_readpolicy,has_readpolicy
 from utils import NotRunException
+import fixtures
 
 class DioRandread(FioTest):
     name = "diorandread"
     command = ("--name diorandread --direct=1 --size=1g --rw=randread "
                "--runtime=60 --iodepth=1024 --nrfiles=16 "
                "--numjobs=16")
+    fixture = fixtures.FIO_16X1G
 
     def setup(self, config, section):
         device = config.get(section, 'device')
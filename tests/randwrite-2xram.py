@@ -9,6 +9,7 @@ class Randwrite2xRam(FioTest):
                "--fallocate=none --ramp_time=10 --new_group --rw=randwrite "
                "--size=SIZE --numjobs=4 --bs=BLOCKSIZE --fsync_on_close=0 "
                "--end_fsync=0")
+    fio_log_msec = 1000
 
     def setup(self, config, section):
         bs = config.get(section, "blocksize", fallback="4k")